@@ -0,0 +1,10 @@
+-- Index: matches_player1, matches_player2
+-- Cover the per-player match count and win count in "info player".
+CREATE INDEX IF NOT EXISTS matches_player1 ON matches (player1, player1_score, player2_score);
+CREATE INDEX IF NOT EXISTS matches_player2 ON matches (player2, player2_score, player1_score);
+
+-- Index: players_ranked
+-- Ranked players in leaderboard order. Queries must repeat the WHERE clause
+-- verbatim for the planner to use it. platforms is included so that position
+-- counts never have to visit the table.
+CREATE INDEX IF NOT EXISTS players_ranked ON players (rating_mu DESC, rating_phi, platforms) WHERE platforms <> '' AND rating_phi < 150;
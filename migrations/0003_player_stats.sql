@@ -0,0 +1,15 @@
+-- Table: player_stats
+-- Per-player aggregates over the matches table, kept up to date by the
+-- PlayerStats trigger. current_streak is positive for a winning streak and
+-- negative for a losing streak.
+CREATE TABLE IF NOT EXISTS player_stats (id BIGINT PRIMARY KEY REFERENCES players (id) NOT NULL, matches INTEGER NOT NULL DEFAULT (0), wins INTEGER NOT NULL DEFAULT (0), losses INTEGER NOT NULL DEFAULT (0), current_streak INTEGER NOT NULL DEFAULT (0), best_win_streak INTEGER NOT NULL DEFAULT (0), last_match DATETIME, peak_mu DOUBLE);
+
+-- View: player_stats_rebuild
+-- player_stats computed from scratch, used to backfill the table.
+CREATE VIEW IF NOT EXISTS player_stats_rebuild AS WITH results AS (SELECT player1 AS id, id AS match_id, date, player1_score > player2_score AS won, player1_new_mu AS new_mu FROM matches UNION ALL SELECT player2, id, date, player2_score > player1_score, player2_new_mu FROM matches), runs AS (SELECT id, match_id, won, ROW_NUMBER() OVER (PARTITION BY id ORDER BY match_id) - ROW_NUMBER() OVER (PARTITION BY id, won ORDER BY match_id) AS run FROM results), run_lengths AS (SELECT id, won, COUNT(*) AS length, MAX(match_id) AS last_match_id FROM runs GROUP BY id, won, run), streaks AS (SELECT id, MAX(CASE WHEN won THEN length ELSE 0 END) AS best_win_streak, (SELECT CASE WHEN last.won THEN last.length ELSE -last.length END FROM run_lengths AS last WHERE last.id = run_lengths.id ORDER BY last.last_match_id DESC LIMIT 1) AS current_streak FROM run_lengths GROUP BY id) SELECT results.id, COUNT(*) AS matches, SUM(won) AS wins, COUNT(*) - SUM(won) AS losses, streaks.current_streak, streaks.best_win_streak, MAX(date) AS last_match, MAX(new_mu) AS peak_mu FROM results JOIN streaks ON streaks.id = results.id GROUP BY results.id;
+
+-- Trigger: PlayerStats
+CREATE TRIGGER IF NOT EXISTS PlayerStats AFTER INSERT ON matches BEGIN INSERT INTO player_stats (id, matches, wins, losses, current_streak, best_win_streak, last_match, peak_mu) VALUES (new.player1, 1, new.player1_score > new.player2_score, new.player1_score < new.player2_score, CASE WHEN new.player1_score > new.player2_score THEN 1 ELSE -1 END, new.player1_score > new.player2_score, new.date, new.player1_new_mu) ON CONFLICT (id) DO UPDATE SET matches = matches + 1, wins = wins + excluded.wins, losses = losses + excluded.losses, current_streak = CASE WHEN excluded.wins THEN MAX(current_streak, 0) + 1 ELSE MIN(current_streak, 0) - 1 END, best_win_streak = MAX(best_win_streak, CASE WHEN excluded.wins THEN MAX(current_streak, 0) + 1 ELSE 0 END), last_match = excluded.last_match, peak_mu = MAX(peak_mu, excluded.peak_mu); INSERT INTO player_stats (id, matches, wins, losses, current_streak, best_win_streak, last_match, peak_mu) VALUES (new.player2, 1, new.player2_score > new.player1_score, new.player2_score < new.player1_score, CASE WHEN new.player2_score > new.player1_score THEN 1 ELSE -1 END, new.player2_score > new.player1_score, new.date, new.player2_new_mu) ON CONFLICT (id) DO UPDATE SET matches = matches + 1, wins = wins + excluded.wins, losses = losses + excluded.losses, current_streak = CASE WHEN excluded.wins THEN MAX(current_streak, 0) + 1 ELSE MIN(current_streak, 0) - 1 END, best_win_streak = MAX(best_win_streak, CASE WHEN excluded.wins THEN MAX(current_streak, 0) + 1 ELSE 0 END), last_match = excluded.last_match, peak_mu = MAX(peak_mu, excluded.peak_mu); END;
+
+-- Backfill from the existing match history.
+INSERT OR REPLACE INTO player_stats SELECT * FROM player_stats_rebuild;
@@ -0,0 +1,4 @@
+-- Table: role_sync_queue
+-- Rank role changes that still have to be applied on Discord. Ranks are
+-- stored as rank values (-1 for placements, NULL for no rank role at all).
+CREATE TABLE IF NOT EXISTS role_sync_queue (member_id BIGINT PRIMARY KEY NOT NULL, old_rank INTEGER, new_rank INTEGER, queued DATETIME DEFAULT (datetime('now')) NOT NULL);
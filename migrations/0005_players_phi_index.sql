@@ -0,0 +1,4 @@
+-- Index: players_phi
+-- Registered players by rating deviation, so that the rating period update can
+-- find the players about to lose their rank with a range scan.
+CREATE INDEX IF NOT EXISTS players_phi ON players (rating_phi, rating_mu, id) WHERE platforms <> '';
@@ -0,0 +1,9 @@
+-- Columns: pending_matches
+-- The reporting state of pending matches, so that it survives a restart.
+-- confirming_timestamp is the POSIX time of the last score report, NULL while
+-- no scores were reported.
+ALTER TABLE pending_matches ADD COLUMN player1_score INTEGER;
+ALTER TABLE pending_matches ADD COLUMN player2_score INTEGER;
+ALTER TABLE pending_matches ADD COLUMN confirm_status INTEGER DEFAULT (0) NOT NULL;
+ALTER TABLE pending_matches ADD COLUMN cancel_status INTEGER DEFAULT (0) NOT NULL;
+ALTER TABLE pending_matches ADD COLUMN confirming_timestamp DOUBLE;
@@ -0,0 +1,8 @@
+-- View: player_stats_rebuild
+-- Counts losses like the PlayerStats trigger, so that a draw is neither a win
+-- nor a loss. The view of 0003 counted every match that wasn't won as lost.
+DROP VIEW IF EXISTS player_stats_rebuild;
+CREATE VIEW player_stats_rebuild AS WITH results AS (SELECT player1 AS id, id AS match_id, date, player1_score > player2_score AS won, player1_score < player2_score AS lost, player1_new_mu AS new_mu FROM matches UNION ALL SELECT player2, id, date, player2_score > player1_score, player2_score < player1_score, player2_new_mu FROM matches), runs AS (SELECT id, match_id, won, ROW_NUMBER() OVER (PARTITION BY id ORDER BY match_id) - ROW_NUMBER() OVER (PARTITION BY id, won ORDER BY match_id) AS run FROM results), run_lengths AS (SELECT id, won, COUNT(*) AS length, MAX(match_id) AS last_match_id FROM runs GROUP BY id, won, run), streaks AS (SELECT id, MAX(CASE WHEN won THEN length ELSE 0 END) AS best_win_streak, (SELECT CASE WHEN last.won THEN last.length ELSE -last.length END FROM run_lengths AS last WHERE last.id = run_lengths.id ORDER BY last.last_match_id DESC LIMIT 1) AS current_streak FROM run_lengths GROUP BY id) SELECT results.id, COUNT(*) AS matches, SUM(won) AS wins, SUM(lost) AS losses, streaks.current_streak, streaks.best_win_streak, MAX(date) AS last_match, MAX(new_mu) AS peak_mu FROM results JOIN streaks ON streaks.id = results.id GROUP BY results.id;
+
+-- Backfill again with the corrected losses.
+INSERT OR REPLACE INTO player_stats SELECT * FROM player_stats_rebuild;
@@ -0,0 +1,14 @@
+-- Table: journal_state
+-- sequence is increased by every write transaction of the bot, and every
+-- event of core.event_log carries the sequence of the transaction it comes
+-- from. A backup thus knows exactly which events of the journal it already
+-- has, which tools/replay_events.py skips.
+CREATE TABLE IF NOT EXISTS journal_state (id INTEGER PRIMARY KEY CHECK (id = 0) NOT NULL, sequence INTEGER NOT NULL);
+INSERT OR IGNORE INTO journal_state (id, sequence) VALUES (0, 0);
+
+-- Table: rating_decay
+-- The start of the last rating period whose deviation increase is applied, as
+-- a POSIX timestamp. A decay is only applied for a later period, so that
+-- applying one twice changes nothing.
+CREATE TABLE IF NOT EXISTS rating_decay (id INTEGER PRIMARY KEY CHECK (id = 0) NOT NULL, period_start INTEGER NOT NULL);
+INSERT OR IGNORE INTO rating_decay (id, period_start) VALUES (0, 0);
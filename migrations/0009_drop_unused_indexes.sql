@@ -0,0 +1,8 @@
+-- Index: players_ranked, matches_player1, matches_player2
+-- No longer used by any query. The ranked players are read through
+-- players_phi and kept in leaderboard order by core.rank_index, and the match
+-- counts of "info player" come from player_stats. Dropped so that writes to
+-- players and matches no longer maintain them.
+DROP INDEX IF EXISTS players_ranked;
+DROP INDEX IF EXISTS matches_player1;
+DROP INDEX IF EXISTS matches_player2;
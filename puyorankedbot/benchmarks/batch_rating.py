@@ -0,0 +1,67 @@
+# Recomputes the ratings of a synthetic match history, once match by match
+# with rate_1vs1 like the bot does when a match is reported, and once rating
+# period by rating period with core.batch_rating.
+# Run from the puyorankedbot directory: python -m benchmarks.batch_rating
+
+import argparse
+import random
+import time
+from core.glicko2 import glicko2
+from core.batch_rating import BatchRating
+
+def generate_history(player_count, match_count, period_count):
+	skills = [random.gauss(1500, 300) for _ in range(player_count)]
+	periods = [[] for _ in range(period_count)]
+	for i in range(match_count):
+		player1, player2 = random.sample(range(player_count), 2)
+		chance = 1 / (1 + 10 ** ((skills[player2] - skills[player1]) / 400))
+		periods[i * period_count // match_count].append(
+			(player1, player2, 1 if random.random() < chance else 0)
+		)
+	return periods
+
+def replay_matches(player_count, periods):
+	ratings = [glicko2.Rating() for _ in range(player_count)]
+	for games in periods:
+		for player1, player2, score1 in games:
+			if score1 == 1:
+				ratings[player1], ratings[player2] = (
+					glicko2.Glicko2().rate_1vs1(ratings[player1], ratings[player2])
+				)
+			else:
+				ratings[player2], ratings[player1] = (
+					glicko2.Glicko2().rate_1vs1(ratings[player2], ratings[player1])
+				)
+	return ratings
+
+def replay_periods(player_count, periods):
+	engine = BatchRating()
+	ratings = {player_id: (1500, 350, 0.06) for player_id in range(player_count)}
+	for games in periods:
+		new_ratings = engine.rate_period(ratings, games)
+		for player_id, rating in ratings.items():
+			ratings[player_id] = new_ratings.get(player_id) or engine.rate_inactive(rating)
+	return ratings
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the batch rating engine.")
+	parser.add_argument("--players", type=int, default=2000)
+	parser.add_argument("--matches", type=int, nargs="+", default=[10000, 100000])
+	parser.add_argument("--periods", type=int, default=52)
+	args = parser.parse_args()
+
+	for match_count in args.matches:
+		periods = generate_history(args.players, match_count, args.periods)
+		start = time.perf_counter()
+		replay_matches(args.players, periods)
+		match_time = time.perf_counter() - start
+		start = time.perf_counter()
+		replay_periods(args.players, periods)
+		period_time = time.perf_counter() - start
+		print(
+			f"{match_count:>7} matches | match by match {match_time:7.2f} s | "
+			f"by rating period {period_time:7.2f} s | {match_time / period_time:5.1f}x"
+		)
+
+if __name__ == "__main__":
+	main()
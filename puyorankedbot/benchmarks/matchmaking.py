@@ -0,0 +1,96 @@
+# Measures the latency of a player joining a matchmaking pool, comparing the
+# previous full ribbon rebuild with core.matchmaking.Pool.
+# Run from the puyorankedbot directory: python -m benchmarks.matchmaking
+
+import argparse
+import random
+import time
+from core.matchmaking import Pool
+
+class QueuedPlayer:
+	def __init__(self, low, high):
+		self.low = low
+		self.high = high
+		self.resolved = False
+
+class Node:
+	def __init__(self, start, player, value):
+		self.start = start
+		self.player = player
+		self.value = value
+
+	def __lt__(self, that):
+		return (
+			self.value < that.value or
+			(self.value == that.value and self.start and not that.start)
+		)
+
+def populate_matches(pool):
+	# The previous implementation, run over the whole pool on every join.
+	ribbon = []
+	for player in pool:
+		ribbon.append(Node(True, player, player.low))
+		ribbon.append(Node(False, player, player.high))
+	ribbon.sort()
+	matches = []
+	current_player = None
+	for node in ribbon:
+		if node.player.resolved:
+			continue
+		if node.start:
+			if current_player is None:
+				current_player = node.player
+			else:
+				matches.append((current_player, node.player))
+				current_player = None
+		else:
+			current_player = None
+	return matches
+
+def queued_players(count):
+	# Disjoint windows with a gap after each one, so nobody gets matched.
+	return [QueuedPlayer(20 * i, 20 * i + 10) for i in range(count)]
+
+def joining_player(count):
+	i = random.randrange(count)
+	return QueuedPlayer(20 * i + 12, 20 * i + 18)
+
+def measure_ribbon(count, joins):
+	pool = set(queued_players(count))
+	start = time.perf_counter()
+	for _ in range(joins):
+		player = joining_player(count)
+		pool.add(player)
+		populate_matches(pool)
+		pool.discard(player)
+	return (time.perf_counter() - start) / joins
+
+def measure_pool(count, joins):
+	pool = Pool(0)
+	for player in queued_players(count):
+		pool.add(player)
+	start = time.perf_counter()
+	for _ in range(joins):
+		player = joining_player(count)
+		pool.add(player)
+		pool.discard(player)
+	return (time.perf_counter() - start) / joins
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark matchmaking queue joins.")
+	parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 50000])
+	parser.add_argument("--time-budget", type=float, default=2.0)
+	args = parser.parse_args()
+
+	for count in args.sizes:
+		# Keep the slow variant within a few seconds at large pool sizes.
+		ribbon_joins = max(3, min(1000, int(args.time_budget / (count * 2e-6 + 1e-6))))
+		ribbon = measure_ribbon(count, ribbon_joins)
+		pool = measure_pool(count, 10000)
+		print(
+			f"{count:>6} queued | ribbon {ribbon * 1e6:10.1f} µs/join | "
+			f"pool {pool * 1e6:6.1f} µs/join | {ribbon / pool:8.1f}x"
+		)
+
+if __name__ == "__main__":
+	main()
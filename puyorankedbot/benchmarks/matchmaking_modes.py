@@ -0,0 +1,126 @@
+# Simulates a matchmaking queue to compare the greedy pairing, done as each
+# player joins, with the optimal pairing of core.matchmaking, done once per
+# tick. Players arrive at random and leave the queue if they wait too long.
+# Run from the puyorankedbot directory: python -m benchmarks.matchmaking_modes
+
+import argparse
+import random
+import statistics
+import time
+from core.matchmaking import Pool, find_optimal_matches
+
+class QueuedPlayer:
+	def __init__(self, arrival, patience):
+		self.arrival = arrival
+		self.departure = arrival + patience
+		self.mu = random.gauss(1500, 300)
+		phi = random.uniform(50, 200)
+		self.low = self.mu - 2*phi
+		self.high = self.mu + 2*phi
+		platforms = random.sample(range(3), random.choice([1, 1, 1, 2, 3]))
+		# Joined one after the other, the first one is the preferred platform.
+		self.queued_platforms = {
+			index: arrival + i * 0.5
+			for i, index in enumerate(platforms)
+		}
+		self.preferred = platforms[0]
+
+def generate_players(rate, duration, patience):
+	players = []
+	now = random.expovariate(rate)
+	while now < duration:
+		players.append(QueuedPlayer(now, random.expovariate(1 / patience)))
+		now += random.expovariate(rate)
+	return players
+
+def remove(pools, player):
+	for pool in pools:
+		pool.discard(player)
+
+def simulate_greedy(players):
+	pools = [Pool(i) for i in range(3)]
+	matches = []
+	queued = []
+	for player in players:
+		now = player.arrival
+		queued = [other for other in queued if other.departure > now or remove(pools, other)]
+		for index in player.queued_platforms:
+			partner = pools[index].add(player)
+			if partner is not None:
+				remove(pools, partner)
+				remove(pools, player)
+				matches.append((partner, player, index, now))
+				break
+		else:
+			queued.append(player)
+	return matches
+
+def simulate_optimal(players, tick, time_budget):
+	pools = [Pool(i) for i in range(3)]
+	matches = []
+	queued = []
+	next_player = 0
+	now = 0
+	solve_time = 0
+	while next_player < len(players):
+		now += tick
+		queued = [other for other in queued if other.departure > now or remove(pools, other)]
+		arrivals = [[] for _ in pools]
+		while next_player < len(players) and players[next_player].arrival <= now:
+			player = players[next_player]
+			next_player += 1
+			if player.departure <= now:
+				continue
+			queued.append(player)
+			for index in player.queued_platforms:
+				arrivals[index].append(player)
+		start = time.perf_counter()
+		found = find_optimal_matches(pools, arrivals, now, time_budget)
+		solve_time = max(solve_time, time.perf_counter() - start)
+		matched = set()
+		for player1, player2, index in found:
+			matches.append((player1, player2, index, now))
+			matched.update((player1, player2))
+		queued = [player for player in queued if player not in matched]
+	return matches, solve_time
+
+def report(name, players, matches):
+	gaps = [abs(player1.mu - player2.mu) for player1, player2, _, _ in matches]
+	waits = [
+		now - player.arrival
+		for player1, player2, _, now in matches
+		for player in (player1, player2)
+	]
+	preferred = sum(
+		(index == player1.preferred) + (index == player2.preferred)
+		for player1, player2, index, _ in matches
+	)
+	waits.sort()
+	print(
+		f"{name:>7} | {2 * len(matches) / len(players):6.1%} matched | "
+		f"gap {statistics.fmean(gaps):6.1f} | "
+		f"wait mean {statistics.fmean(waits):6.1f} s, p90 {waits[int(len(waits) * 0.9)]:6.1f} s | "
+		f"{preferred / len(waits):6.1%} on preferred platform"
+	)
+
+def main():
+	parser = argparse.ArgumentParser(description="Compare the matchmaking modes on a simulated queue.")
+	parser.add_argument("--rates", type=float, nargs="+", default=[0.05, 0.5, 5])
+	parser.add_argument("--duration", type=float, default=3600)
+	parser.add_argument("--patience", type=float, default=300)
+	parser.add_argument("--tick", type=float, default=1)
+	parser.add_argument("--time-budget", type=float, default=0.05)
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+
+	for rate in args.rates:
+		random.seed(args.seed)
+		players = generate_players(rate, args.duration, args.patience)
+		print(f"{rate} arrivals/s, {len(players)} players")
+		report("greedy", players, simulate_greedy(players))
+		matches, solve_time = simulate_optimal(players, args.tick, args.time_budget)
+		report("optimal", players, matches)
+		print(f"{'':>7} | slowest tick {solve_time * 1000:.1f} ms")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,162 @@
+# Benchmarks the queries behind "info player" and "leaderboard" on a synthetic
+# database, before and after the indexes of migration 0002.
+# Run from the puyorankedbot directory: python -m benchmarks.player_queries
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+migrations_path = "../migrations"
+
+old_queries = {
+	"match count": (
+		"SELECT COUNT(*), "
+		"COUNT("
+			"CASE WHEN (player1 = :id) == (player1_score > player2_score) "
+			"THEN 1 ELSE NULL END"
+		") FROM matches WHERE player1=:id OR player2=:id"
+	),
+	"position": (
+		"SELECT COUNT(*) FROM players WHERE "
+		"platforms <> '' AND rating_phi < 150 AND "
+		"(rating_mu > :mu OR rating_mu = :mu AND rating_phi < :phi)"
+	),
+	"leaderboard": (
+		"SELECT id, display_name, rating_mu, rating_phi "
+		"FROM players WHERE platforms <> '' AND rating_phi < 150 "
+		"ORDER BY rating_mu DESC, rating_phi ASC LIMIT 10"
+	)
+}
+
+new_queries = {
+	"match count": (
+		"SELECT COUNT(*), COALESCE(SUM(won), 0) FROM ("
+			"SELECT player1_score > player2_score AS won "
+			"FROM matches WHERE player1 = :id "
+			"UNION ALL "
+			"SELECT player2_score > player1_score "
+			"FROM matches WHERE player2 = :id"
+		")"
+	),
+	"position": (
+		"SELECT ("
+			"SELECT COUNT(*) FROM players WHERE "
+			"platforms <> '' AND rating_phi < 150 AND rating_mu > :mu"
+		") + ("
+			"SELECT COUNT(*) FROM players WHERE "
+			"platforms <> '' AND rating_phi < 150 AND "
+			"rating_mu = :mu AND rating_phi < :phi"
+		")"
+	),
+	"leaderboard": old_queries["leaderboard"]
+}
+
+def apply_migrations(connection, first, last):
+	for file_name in sorted(os.listdir(migrations_path)):
+		if not file_name.endswith(".sql"): continue
+		number = int(file_name.split("_", 1)[0])
+		if first <= number <= last:
+			with open(os.path.join(migrations_path, file_name), "r") as f:
+				connection.executescript(f.read())
+
+def populate(connection, player_count, match_count):
+	# The triggers only matter for live inserts, and they would dominate the
+	# time spent generating the data.
+	for (name,) in connection.execute(
+		"SELECT name FROM sqlite_master WHERE type = 'trigger'"
+	).fetchall():
+		connection.execute(f"DROP TRIGGER {name}")
+	connection.executemany(
+		"INSERT INTO players (id, platforms, rating_mu, rating_phi) VALUES (?, ?, ?, ?)",
+		(
+			(
+				player_id,
+				random.choice(["pc", "switch", "ps4", "pc switch", ""]),
+				random.gauss(1500, 300),
+				random.uniform(50, 350)
+			)
+			for player_id in range(1, player_count + 1)
+		)
+	)
+	def matches():
+		for _ in range(match_count):
+			player1, player2 = random.sample(range(1, player_count + 1), 2)
+			winner_score = 10
+			loser_score = random.randrange(10)
+			scores = (
+				(winner_score, loser_score) if random.random() < 0.5 else
+				(loser_score, winner_score)
+			)
+			yield (player1, player2) + scores + (1500, 100, 0.06) * 4
+	connection.executemany(
+		"INSERT INTO matches ("
+			"player1, player2, player1_score, player2_score, "
+			"player1_old_mu, player1_old_phi, player1_old_sigma, "
+			"player1_new_mu, player1_new_phi, player1_new_sigma, "
+			"player2_old_mu, player2_old_phi, player2_old_sigma, "
+			"player2_new_mu, player2_new_phi, player2_new_sigma"
+		") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+		matches()
+	)
+	connection.commit()
+
+def measure(connection, queries, player_count, runs):
+	results = {}
+	for name, sql in queries.items():
+		timings = []
+		for _ in range(runs):
+			parameters = {
+				"id": random.randint(1, player_count),
+				"mu": random.gauss(1500, 300),
+				"phi": random.uniform(50, 150)
+			}
+			start = time.perf_counter()
+			connection.execute(sql, parameters).fetchall()
+			timings.append((time.perf_counter() - start) * 1000)
+		timings.sort()
+		results[name] = (
+			sum(timings) / runs,
+			timings[runs // 2],
+			timings[min(runs - 1, runs * 99 // 100)]
+		)
+	return results
+
+def print_results(title, results):
+	print(title)
+	for name, (mean, median, p99) in results.items():
+		print(f"  {name:<12} mean {mean:9.3f} ms | p50 {median:9.3f} ms | p99 {p99:9.3f} ms")
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark player lookup queries.")
+	parser.add_argument("--players", type=int, default=10000)
+	parser.add_argument("--matches", type=int, default=1000000)
+	parser.add_argument("--runs", type=int, default=50)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as directory:
+		connection = sqlite3.connect(os.path.join(directory, "benchmark.db3"))
+		apply_migrations(connection, 1, 1)
+		start = time.perf_counter()
+		populate(connection, args.players, args.matches)
+		print(
+			f"Generated {args.players} players and {args.matches} matches "
+			f"in {time.perf_counter() - start:.1f} s."
+		)
+		print_results(
+			"Before (schema 0001, original queries):",
+			measure(connection, old_queries, args.players, args.runs)
+		)
+		start = time.perf_counter()
+		apply_migrations(connection, 2, 2)
+		print(f"Built the indexes in {time.perf_counter() - start:.1f} s.")
+		print_results(
+			"After (schema 0002, rewritten queries):",
+			measure(connection, new_queries, args.players, args.runs)
+		)
+		connection.close()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,87 @@
+# Compares the rating period decay done row by row in Python with the single
+# UPDATE statement of scheduled_rating_update.decay_ratings.
+# Run from the puyorankedbot directory: python -m benchmarks.rating_decay
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from core import database
+from core.scheduled_rating_update import decay_ratings
+
+def decay_ratings_loop(connection, c):
+	# The previous implementation, without the role updates.
+	feed_in = connection.execute("SELECT rowid, id, platforms, rating_mu, rating_phi FROM players")
+	feed_out = connection.cursor()
+	while True:
+		batch = feed_in.fetchmany(1024)
+		if len(batch) == 0: break
+		data_load = []
+		for player in batch:
+			new_phi = min(350, (player[4]**2 + c)**0.5)
+			data_load.append((new_phi, player[0]))
+		feed_out.executemany(
+			"UPDATE players SET rating_phi = ? WHERE rowid = ?",
+			data_load
+		)
+	connection.commit()
+
+def create_database(directory, player_count):
+	database.path = os.path.join(directory, f"players_{player_count}.db3")
+	database.migrate()
+	connection = database.connect()
+	connection.executemany(
+		"INSERT INTO players (id, platforms, rating_mu, rating_phi) VALUES (?, ?, ?, ?)",
+		(
+			(
+				player_id,
+				random.choice(["pc", "switch", "ps4", "pc switch", ""]),
+				random.gauss(1500, 300),
+				random.uniform(50, 350)
+			)
+			for player_id in range(1, player_count + 1)
+		)
+	)
+	connection.commit()
+	copy_path = database.path + ".copy"
+	copy = sqlite3.connect(copy_path)
+	connection.backup(copy)
+	copy.close()
+	connection.close()
+	return database.path, copy_path
+
+def main():
+	parser = argparse.ArgumentParser(description="Benchmark the rating period decay.")
+	parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+	parser.add_argument("--c", type=float, default=1200)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as directory:
+		for player_count in args.sizes:
+			loop_path, bulk_path = create_database(directory, player_count)
+
+			database.path = loop_path
+			connection = database.connect()
+			start = time.perf_counter()
+			decay_ratings_loop(connection, args.c)
+			loop_time = time.perf_counter() - start
+			connection.close()
+
+			database.path = bulk_path
+			connection = database.connect()
+			start = time.perf_counter()
+			with connection:
+				crossings = decay_ratings(connection, args.c)
+			bulk_time = time.perf_counter() - start
+			connection.close()
+
+			print(
+				f"{player_count:>8} players | loop {loop_time * 1000:9.1f} ms | "
+				f"single UPDATE {bulk_time * 1000:9.1f} ms | "
+				f"{loop_time / bulk_time:5.1f}x | {len(crossings)} crossings"
+			)
+
+if __name__ == "__main__":
+	main()
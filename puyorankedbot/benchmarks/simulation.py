@@ -0,0 +1,518 @@
+# Runs the matchmaking and match reporting code against in-memory stand-ins of
+# the Discord bot, guild, channels, messages and reactions, with simulated
+# players joining the queue, playing, reporting and confirming matches.
+# Everything happens in a temporary directory with its own config.json and
+# database, in real time.
+# Run from the puyorankedbot directory: python -m benchmarks.simulation
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+# API calls made to the fake Discord layer, by method name.
+api_calls = Counter()
+# Seconds each API call takes.
+api_latency = 0
+ids = itertools.count(10**17)
+
+async def api_call(name):
+	api_calls[name] += 1
+	if api_latency != 0:
+		await asyncio.sleep(api_latency)
+
+class FakeEmoji:
+	def __init__(self, id=None, name=None):
+		self.id = id
+		self.name = name
+
+	def __eq__(self, that):
+		if isinstance(that, str):
+			return self.id is None and self.name == that
+		return isinstance(that, FakeEmoji) and (self.id, self.name) == (that.id, that.name)
+
+	def __hash__(self):
+		return hash((self.id, self.name))
+
+def as_emoji(emoji):
+	return FakeEmoji(name=emoji) if isinstance(emoji, str) else emoji
+
+class FakeUser:
+	def __init__(self, id, name):
+		self.id = id
+		self.name = name
+		self.display_name = name
+		self.discriminator = "0000"
+		self.mention = f"<@!{id}>"
+		self.roles = set()
+
+	async def add_roles(self, *roles):
+		await api_call("add_roles")
+		self.roles.update(role.id for role in roles)
+
+	async def remove_roles(self, *roles):
+		await api_call("remove_roles")
+		self.roles.difference_update(role.id for role in roles)
+
+class FakeReaction:
+	def __init__(self, message, emoji):
+		self.message = message
+		self.emoji = emoji.name if emoji.id is None else emoji
+		self.user_ids = []
+
+	@property
+	def count(self):
+		return len(self.user_ids)
+
+	async def users(self):
+		await api_call("reaction.users")
+		for user_id in list(self.user_ids):
+			yield self.message.channel.bot.users[user_id]
+
+class FakeMessage:
+	def __init__(self, channel, content=None, embed=None):
+		self.id = next(ids)
+		self.channel = channel
+		self.content = content
+		self.embed = embed
+		self.reactions = []
+
+	def get_reaction(self, emoji):
+		emoji = as_emoji(emoji)
+		for reaction in self.reactions:
+			if as_emoji(reaction.emoji) == emoji:
+				return reaction
+		reaction = FakeReaction(self, emoji)
+		self.reactions.append(reaction)
+		return reaction
+
+	def react(self, user, emoji, adding):
+		"""
+		Adds or removes the reaction of a user, then dispatches the raw reaction
+		event like the gateway does. Reactions of the bot itself are made through
+		the API methods below.
+		"""
+		emoji = as_emoji(emoji)
+		reaction = self.get_reaction(emoji)
+		if adding == (user.id in reaction.user_ids):
+			return
+		if adding:
+			reaction.user_ids.append(user.id)
+		else:
+			reaction.user_ids.remove(user.id)
+		self.channel.bot.dispatch(
+			"raw_reaction_add" if adding else "raw_reaction_remove",
+			FakeReactionEvent(self, user, emoji, adding)
+		)
+
+	async def add_reaction(self, emoji):
+		await api_call("add_reaction")
+		reaction = self.get_reaction(emoji)
+		if self.channel.bot.user.id not in reaction.user_ids:
+			reaction.user_ids.append(self.channel.bot.user.id)
+
+	async def remove_reaction(self, emoji, member):
+		await api_call("remove_reaction")
+		reaction = self.get_reaction(emoji)
+		if member.id in reaction.user_ids:
+			reaction.user_ids.remove(member.id)
+			self.channel.bot.dispatch(
+				"raw_reaction_remove",
+				FakeReactionEvent(self, member, as_emoji(emoji), False)
+			)
+
+	async def clear_reactions(self):
+		await api_call("clear_reactions")
+		self.reactions = []
+
+class FakeReactionEvent:
+	def __init__(self, message, user, emoji, adding):
+		self.message_id = message.id
+		self.channel_id = message.channel.id
+		self.guild_id = message.channel.guild.id
+		self.user_id = user.id
+		self.member = user if adding else None
+		self.emoji = emoji
+		self.event_type = "REACTION_ADD" if adding else "REACTION_REMOVE"
+
+class FakeChannel:
+	def __init__(self, bot, guild):
+		self.id = next(ids)
+		self.bot = bot
+		self.guild = guild
+		self.messages = {}
+		self.listeners = []
+
+	async def send(self, content=None, embed=None):
+		await api_call("send")
+		message = FakeMessage(self, content, embed)
+		self.messages[message.id] = message
+		for listener in self.listeners:
+			listener(message)
+		return message
+
+	async def fetch_message(self, message_id):
+		await api_call("fetch_message")
+		return self.messages[message_id]
+
+	def get_partial_message(self, message_id):
+		return self.messages[message_id]
+
+class FakeGuild:
+	def __init__(self, bot):
+		self.id = next(ids)
+		self.bot = bot
+		self.emojis = [FakeEmoji(next(ids), name) for name in ("pc", "switch", "ps4")]
+
+	async def fetch_member(self, member_id):
+		import discord
+		await api_call("fetch_member")
+		if member_id not in self.bot.users:
+			raise discord.NotFound(FakeResponse(404, "Not Found"), "Unknown Member")
+		return self.bot.users[member_id]
+
+class FakeResponse:
+	def __init__(self, status, reason):
+		self.status = status
+		self.reason = reason
+
+class FakeBot:
+	command_prefix = "!"
+
+	def __init__(self):
+		self.user = FakeUser(next(ids), "bot")
+		self.users = {self.user.id: self.user}
+		self.listeners = {}
+		self.channels = {}
+		self.guild = FakeGuild(self)
+
+	def create_channel(self):
+		channel = FakeChannel(self, self.guild)
+		self.channels[channel.id] = channel
+		return channel
+
+	def get_channel(self, channel_id):
+		return self.channels.get(channel_id)
+
+	def add_listener(self, func, name):
+		self.listeners.setdefault(name, []).append(func)
+
+	def dispatch(self, event, *args):
+		# Like discord.py, every listener runs in its own task.
+		for listener in self.listeners.get("on_" + event, []):
+			asyncio.create_task(listener(*args))
+
+class FakeContext:
+	def __init__(self, bot, channel, author):
+		self.bot = bot
+		self.channel = channel
+		self.author = author
+
+	async def send(self, content=None, embed=None):
+		return await self.channel.send(content, embed=embed)
+
+	async def send_help(self, command):
+		await api_call("send_help")
+
+class Simulation:
+	"""
+	Simulated players, each of them either idle, queued or in a match.
+	"""
+	def __init__(self, args, bot, channels):
+		self.args = args
+		self.bot = bot
+		self.command_channel, self.matchmaking_channel, self.announcement_channel = channels
+		self.matchfinding_message = next(iter(self.matchmaking_channel.messages.values()))
+		self.players = {}
+		self.idle = set()
+		self.joined = {}
+		self.latencies = []
+		self.events = 0
+		self.matches = 0
+		self.recorded = 0
+		self.timeouts = 0
+		self.announcement_channel.listeners.append(self.on_announcement)
+		self.command_channel.listeners.append(self.on_output)
+
+	def create_players(self, connection):
+		platforms = ["pc", "switch", "ps4"]
+		rows = []
+		for i in range(self.args.players):
+			user = FakeUser(next(ids), f"player{i}")
+			self.bot.users[user.id] = user
+			user.platforms = random.sample(platforms, random.choice([1, 1, 2, 3]))
+			self.players[user.id] = user
+			self.idle.add(user.id)
+			rows.append((
+				user.id, " ".join(user.platforms), user.name,
+				random.gauss(1500, 300), random.uniform(50, 350)
+			))
+		connection.executemany(
+			"INSERT INTO players (id, platforms, display_name, rating_mu, rating_phi) "
+			"VALUES (?, ?, ?, ?, ?)",
+			rows
+		)
+		connection.commit()
+
+	def create_backlog(self, connection):
+		"""
+		Creates pending matches that expired while the bot was offline.
+		"""
+		rows = []
+		for _ in range(self.args.backlog):
+			player_ids = random.sample(tuple(self.idle), 2)
+			self.idle.difference_update(player_ids)
+			message = FakeMessage(self.announcement_channel, "")
+			self.announcement_channel.messages[message.id] = message
+			reaction = message.get_reaction("\u2705")
+			reaction.user_ids.append(self.bot.user.id)
+			reaction.user_ids.extend(
+				player_id for player_id in player_ids
+				if random.random() < self.args.confirm_rate
+			)
+			rows.append((message.id, *player_ids, datetime.now() - timedelta(days=1)))
+		connection.executemany(
+			"INSERT INTO pending_matches (message_id, player1, player2, time) VALUES (?, ?, ?, ?)",
+			rows
+		)
+		connection.commit()
+
+	async def run(self):
+		end = time.monotonic() + self.args.duration
+		while time.monotonic() < end:
+			await asyncio.sleep(random.expovariate(self.args.rate))
+			if len(self.idle) == 0:
+				continue
+			user = self.players[random.choice(tuple(self.idle))]
+			self.idle.discard(user.id)
+			asyncio.create_task(self.queue(user))
+
+	async def queue(self, user):
+		self.joined[user.id] = time.monotonic()
+		emoji = self.bot.guild.emojis[["pc", "switch", "ps4"].index(random.choice(user.platforms))]
+		self.events += 1
+		self.matchfinding_message.react(user, emoji, True)
+		await asyncio.sleep(random.expovariate(1 / self.args.patience))
+		if user.id in self.joined:
+			# Still not matched, the player gives up.
+			self.joined.pop(user.id)
+			self.events += 1
+			self.matchfinding_message.react(user, emoji, False)
+			self.idle.add(user.id)
+
+	def on_announcement(self, message):
+		player_ids = [int(i) for i in re.findall(r"<@!(\d+)>", message.content)]
+		goal = int(re.search(r"First to \*\*(\d+)\*\*", message.content).group(1))
+		now = time.monotonic()
+		self.matches += 1
+		for player_id in player_ids:
+			if player_id in self.joined:
+				self.latencies.append(now - self.joined.pop(player_id))
+		asyncio.create_task(self.play(message, player_ids, goal))
+
+	def on_output(self, message):
+		if message.embed is None:
+			return
+		if message.embed.title == "Match recorded":
+			self.recorded += 1
+		elif message.embed.title == "Match timeout":
+			self.timeouts += 1
+
+	async def play(self, message, player_ids, goal):
+		from cogs.matches import Matches
+		from core.match_manager import match_manager
+		players = [self.players[player_id] for player_id in player_ids]
+		try:
+			for player in players:
+				if random.random() < self.args.confirm_rate:
+					self.events += 1
+					message.react(player, "\u2705", True)
+			await asyncio.sleep(random.expovariate(1 / self.args.match_length))
+			cog = Matches(self.bot)
+			if random.random() < self.args.report_rate:
+				winner = random.randrange(2)
+				scores = [goal, random.randrange(goal)]
+				reporter = players[winner]
+				confirmer = players[1 - winner]
+				self.events += 1
+				await cog.match_report.callback(
+					cog, FakeContext(self.bot, self.command_channel, reporter),
+					str(scores[0]), str(scores[1])
+				)
+				if random.random() < self.args.agree_rate:
+					await asyncio.sleep(random.uniform(0, 2))
+					self.events += 1
+					await cog.match_report.callback(
+						cog, FakeContext(self.bot, self.command_channel, confirmer),
+						str(scores[1]), str(scores[0])
+					)
+			elif random.random() < self.args.cancel_rate:
+				for player in players:
+					self.events += 1
+					await cog.match_cancel.callback(
+						cog, FakeContext(self.bot, self.command_channel, player)
+					)
+			# Otherwise the match times out, or the report gets confirmed later.
+			while any(player.id in match_manager.player_map for player in players):
+				await asyncio.sleep(0.5)
+		finally:
+			await asyncio.sleep(random.expovariate(1 / self.args.rest))
+			self.idle.update(player_ids)
+
+def percentile(values, fraction):
+	return values[min(len(values) - 1, int(len(values) * fraction))] if len(values) != 0 else 0
+
+def write_config(directory, bot, channels, args):
+	command_channel, matchmaking_channel, announcement_channel = channels
+	message = next(iter(matchmaking_channel.messages.values()))
+	config = {
+		"guild_id": bot.guild.id,
+		"command_channel": command_channel.id,
+		"matchmaking_message_channel": matchmaking_channel.id,
+		"matchmaking_message_id": message.id,
+		"matchmaking_announcement_channel": announcement_channel.id,
+		"matchmaking_platforms": [
+			[emoji.name, i, emoji.id] for i, emoji in enumerate(bot.guild.emojis)
+		],
+		"matchmaking_tick_delay": args.tick_delay,
+		"matchmaking_mode": args.mode,
+		"pending_match_lifetime": args.lifetime,
+		"rank_roles": {
+			name: next(ids) for name in
+			("bronze", "silver", "gold", "platinum", "diamond", "legend", "placements")
+		},
+		"backup_interval": 3600
+	}
+	with open(os.path.join(directory, "config.json"), "w") as f:
+		json.dump(config, f)
+
+async def simulate(args, bot, channels):
+	# The bot modules read config.json when imported, so they are imported here.
+	from core import database, utils
+	from core.member_cache import member_cache
+	from core.rank_index import rank_index
+	from core.match_manager import matchfinder, match_manager
+
+	database_calls = Counter()
+	def count_calls(name, func):
+		async def counted(*args, **kwargs):
+			database_calls[name] += 1
+			return await func(*args, **kwargs)
+		return counted
+	database.read = count_calls("read", database.read)
+	database.write = count_calls("write", database.write)
+
+	simulation = Simulation(args, bot, channels)
+	connection = database.connect()
+	simulation.create_players(connection)
+	simulation.create_backlog(connection)
+	connection.close()
+
+	utils.bot = bot
+	utils.guild = bot.guild
+	member_cache.setup(bot, bot.guild)
+	await rank_index.load()
+	await matchfinder.setup()
+	start = time.monotonic()
+	await match_manager.setup()
+	if args.backlog != 0:
+		while len(match_manager.message_map) != 0:
+			await asyncio.sleep(0.01)
+		print(f"{args.backlog} expired matches processed in {time.monotonic() - start:.2f} s")
+	api_calls.clear()
+	database_calls.clear()
+
+	start = time.monotonic()
+	await simulation.run()
+	elapsed = time.monotonic() - start
+	# Let the last ticks and reports go through.
+	await asyncio.sleep(args.tick_delay + 1)
+
+	latencies = sorted(simulation.latencies)
+	events = max(1, simulation.events)
+	print(f"{simulation.events} events over {elapsed:.1f} s")
+	print(
+		f"matches: {simulation.matches} ({simulation.matches / elapsed:.2f}/s), "
+		f"{simulation.recorded} recorded, {simulation.timeouts} timed out"
+	)
+	print(
+		f"queue latency: p50 {percentile(latencies, 0.5) * 1000:.0f} ms, "
+		f"p90 {percentile(latencies, 0.9) * 1000:.0f} ms, "
+		f"p99 {percentile(latencies, 0.99) * 1000:.0f} ms"
+	)
+	print(
+		f"database operations per event: {sum(database_calls.values()) / events:.2f} "
+		f"({', '.join(f'{name} {count}' for name, count in sorted(database_calls.items()))})"
+	)
+	print(
+		f"API calls per event: {sum(api_calls.values()) / events:.2f} "
+		f"({', '.join(f'{name} {count}' for name, count in api_calls.most_common())})"
+	)
+	print(f"member cache: {member_cache.stats()}")
+	print(f"matchmaking ticks: {matchfinder.get_tick_stats()}")
+	print(f"matchmaking wait times: {matchfinder.get_wait_stats()}")
+	print("database time by statement:")
+	for name, stats in list(database.get_query_stats().items())[:8]:
+		print(
+			f"  {name}: {stats['count']} runs, total {stats['total'] * 1000:.0f} ms, "
+			f"mean {stats['mean'] * 1000:.2f} ms, max {stats['max'] * 1000:.1f} ms"
+		)
+
+def main():
+	parser = argparse.ArgumentParser(description="Simulate the bot with a fake Discord layer.")
+	parser.add_argument("--players", type=int, default=500, help="Registered players.")
+	parser.add_argument("--rate", type=float, default=10, help="Queue joins per second.")
+	parser.add_argument("--duration", type=float, default=30, help="Seconds of arrivals.")
+	parser.add_argument("--patience", type=float, default=20, help="Mean seconds before leaving the queue.")
+	parser.add_argument("--match-length", type=float, default=3, help="Mean seconds of a match.")
+	parser.add_argument("--rest", type=float, default=5, help="Mean seconds between two matches of a player.")
+	parser.add_argument("--confirm-rate", type=float, default=0.8, help="Chance to react to an announcement.")
+	parser.add_argument("--report-rate", type=float, default=0.8, help="Chance that a match gets reported.")
+	parser.add_argument("--agree-rate", type=float, default=0.9, help="Chance that the opponent confirms a report.")
+	parser.add_argument("--cancel-rate", type=float, default=0.3, help="Chance that an unreported match gets cancelled.")
+	parser.add_argument("--lifetime", type=int, default=15, help="pending_match_lifetime, in seconds.")
+	parser.add_argument("--tick-delay", type=float, default=0.1, help="matchmaking_tick_delay, in seconds.")
+	parser.add_argument("--mode", default="greedy", help="matchmaking_mode.")
+	parser.add_argument("--backlog", type=int, default=0, help="Pending matches expired at startup.")
+	parser.add_argument("--api-latency", type=float, default=0, help="Seconds each API call takes.")
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+	random.seed(args.seed)
+	global api_latency
+	api_latency = args.api_latency
+
+	bot = FakeBot()
+	channels = [bot.create_channel() for _ in range(3)]
+	# The matchfinding message.
+	message = FakeMessage(channels[1])
+	channels[1].messages[message.id] = message
+
+	source = os.getcwd()
+	directory = tempfile.mkdtemp()
+	try:
+		# The bot resolves ../config.json, ../data.db3 and ../discord.log from its
+		# working directory.
+		working_directory = os.path.join(directory, "bot")
+		os.mkdir(working_directory)
+		write_config(directory, bot, channels, args)
+		os.chdir(working_directory)
+		sys.path.insert(0, source)
+		from core import database
+		database.migrations_path = os.path.join(source, "..", "migrations")
+		database.migrate()
+		asyncio.run(simulate(args, bot, channels))
+	finally:
+		os.chdir(source)
+		shutil.rmtree(directory)
+
+if __name__ == "__main__":
+	main()
@@ -1,15 +1,7 @@
 import os
-import sqlite3
 from logger import logger
 import config
 
-if not os.path.exists("../data.db3"):
-	logger.info("Database file not found, initializing a new one.")
-	db = sqlite3.connect("../data.db3")
-	db.executescript(open("../database_schema.sql", "r").read())
-	db.close()
-	logger.info("The database has been set up.")
-
 config.create_config()
 
 import discord
@@ -19,6 +11,13 @@ from core import utils
 from core.match_manager import matchfinder, match_manager
 from core.help import CustomHelpCommand
 from core import database
+from core.rank_index import rank_index
+from core.member_cache import member_cache
+from core.role_sync import role_sync
+from core.backup import backup
+from core.event_log import event_log
+
+database.migrate()
 
 token = config.get_config("token")
 prefix = config.get_config("bot_prefix")
@@ -45,10 +44,14 @@ if __name__ == "__main__":
 async def on_ready():
 	logger.info("Logged in as {}#{}".format(bot.user.name, bot.user.discriminator))
 	utils.guild = await bot.fetch_guild(config.get_config("guild_id"))
+	event_log.setup()
+	member_cache.setup(bot, utils.guild)
+	await rank_index.load()
+	role_sync.setup()
 	scheduled_rating_update.setup()
 	await matchfinder.setup()
-	match_manager.setup()
-	database.setup_backup()
+	await match_manager.setup()
+	backup.setup()
 
 @bot.check
 async def command_check(ctx):
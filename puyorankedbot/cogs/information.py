@@ -2,7 +2,9 @@ import discord
 from discord.ext import commands
 
 from core import utils
-from core.database import database
+from core import database
+from core import queries
+from core.rank_index import rank_index
 
 
 class Information(commands.Cog):
@@ -62,24 +64,13 @@ class Information(commands.Cog):
 		# Why double the phi? Because phi is just half of the distance to the boundary of the 95% confidence
 		# interval. Source: https://www.glicko.net/glicko/glicko2.pdf (lines 7 to 11).
 		embed.add_field(name="Rank", value=rank.name)
-		if player["rating_phi"] < 150:
+		if player["rating_phi"] < utils.placement_phi:
 			embed.add_field(
 				name="Position",
-				value="#" + str(database.execute(
-					"SELECT COUNT(*) FROM players WHERE "
-					"platforms <> '' AND rating_phi < 150 AND "
-					"(rating_mu > :mu OR rating_mu = :mu AND rating_phi < :phi)",
-					{"mu": player["rating_mu"], "phi": player["rating_phi"]}
-				).fetchone()[0] + 1)
+				value="#" + str(rank_index.position(player["rating_mu"], player["rating_phi"]))
 			)
-		matches, wins = database.execute(
-			"SELECT COUNT(*), "
-			"COUNT("
-				"CASE WHEN (player1 = :id) == (player1_score > player2_score) "
-				"THEN 1 ELSE NULL END"
-			") FROM matches WHERE player1=:id OR player2=:id",
-			{"id": player["id"]}
-		).fetchone().tuple
+		stats = await database.fetchone(queries.player_stats, (player["id"],))
+		matches, wins = (0, 0) if stats is None else stats.tuple
 		embed.add_field(name="Matches", value=str(matches))
 		if matches != 0:
 			ratio = wins * 10000 // matches
@@ -140,10 +131,7 @@ class Information(commands.Cog):
 		:param user: A user, which could be a mention, an ID, or anything else Discord can translate into a user.
 		"""
 
-		player = database.execute(
-			"SELECT * FROM players WHERE id=? AND platforms <> ''",
-			(user.id,)
-		).fetchone()
+		player = await database.fetchone(queries.player, (user.id,))
 		if player is None:
 			await ctx.send(f"The user \"{utils.escape_markdown(user.display_name)}\" isn't registered.")
 			return
@@ -178,10 +166,7 @@ class Information(commands.Cog):
 			await ctx.send_help(self.info_player_name)
 			return
 
-		player = database.execute(
-			"SELECT * FROM players WHERE display_name=? AND platforms <> ''",
-			(name,)
-		).fetchone()
+		player = await database.fetchone(queries.player_by_display_name, (name,))
 		if player is None:
 			await ctx.send(
 				"There is no registered player with the display name "
@@ -220,10 +205,7 @@ class Information(commands.Cog):
 			)
 			return
 
-		player = database.execute(
-			f"SELECT * FROM players WHERE username_{platform}=?",
-			(username,)
-		).fetchone()
+		player = await database.fetchone(queries.player_by_username[platform], (username,))
 		if player is None:
 			await ctx.send(
 				"There is no registered player with the username "
@@ -242,10 +224,7 @@ class Information(commands.Cog):
 	# info match
 	async def add_match_embed_player(self, embed, match, player):
 		player = "player" + player
-		player_row = database.execute(
-			"SELECT display_name FROM players WHERE id = ?",
-			(match[player],)
-		).fetchone()
+		player_row = await database.fetchone(queries.player_display_name, (match[player],))
 		name = player_row["display_name"]
 		if name is None:
 			user = await utils.get_member(match[player])
@@ -280,7 +259,7 @@ class Information(commands.Cog):
 			await ctx.send(f"`{ids}` is not a positive integer.")
 			return
 
-		match = database.execute("SELECT * FROM matches WHERE id = ?", (match_id,)).fetchone()
+		match = await database.fetchone(queries.match, (match_id,))
 		if match is None:
 			await ctx.send(f"There is not yet a match with ID {match_id}.")
 			return
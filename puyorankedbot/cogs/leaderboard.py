@@ -1,14 +1,29 @@
+import asyncio
+import json
+import time
 from discord.ext import commands
 
 from core import utils
-from core.database import database
+from core import database
+from core import queries
+from core.rank_index import rank_index
 
 class Leaderboard(commands.Cog):
 	def __init__(self, bot):
 		self.bot = bot
+		self.snapshot = []
+		self.snapshot_version = None
+		# The rows of the ranked players by ID.
+		self.players = {}
+		self.snapshot_lock = asyncio.Lock()
+		self.views = {}
+		self.pages = {}
 		self.help = (
 			"You can view the top ten Puyo players in the server's ranked "
-			"system by using `{0}leaderboard`."
+			"system by using `{0}leaderboard`. Add a page number or a range "
+			"of positions such as `51-60` to see further down, and a "
+			"platform or a rank to only see those players, for example "
+			"`{0}leaderboard switch 2` or `{0}leaderboard diamond`."
 		)
 
 	async def get_player_name(self, player_row):
@@ -16,31 +31,165 @@ class Leaderboard(commands.Cog):
 			return player_row["display_name"]
 		user = await utils.get_member(player_row["id"])
 		return "[No name.]" if user is None else user.display_name
-	
-	@commands.command(
-		name="leaderboard",
-		help="`{0}leaderboard`\nSee the current top players in the system."
-	)
-	async def leaderboard(self, ctx):
-		players = database.execute(
-			"SELECT id, display_name, rating_mu, rating_phi "
-			"FROM players WHERE platforms <> '' AND rating_phi < 150 "
-			"ORDER BY rating_mu DESC, rating_phi ASC LIMIT 10"
-		).fetchall()
-		if len(players) == 0:
-			await ctx.send("There are no players with ranks at the moment, so no leaders to display.")
-			return
 
-		index = 0
-		message = "**Top Puyo players**"
-		for player in players:
-			index += 1
+	page_size = 10
+	page_size_limit = 25
+	# Seconds a rendered page is reused for. Names that come from the member
+	# cache can change without the rank index knowing.
+	page_lifetime = 60
+	rank_mapping = {rank.name.casefold(): rank for rank in utils.ranks}
+
+	@classmethod
+	def parse_range(cls, positions):
+		"""
+		:param positions: A range of positions such as "51-60".
+		:return: The 0-based (start, stop) of the range.
+		"""
+		first, separator, last = positions.partition("-")
+		first = utils.parse_integer(first, True)
+		last = utils.parse_integer(last, True) if separator else first + cls.page_size - 1
+		if first < 1 or last < first:
+			raise Exception(f"`{positions}` is not a valid range of positions.")
+		if last - first >= cls.page_size_limit:
+			raise Exception(f"At most {cls.page_size_limit} positions can be shown at once.")
+		return first - 1, last
+
+	@classmethod
+	def parse_arguments(cls, arguments):
+		"""
+		:param arguments: Any of a platform, a rank, a page number or a range of positions.
+		:return: (view, title, start, stop) where view is None for the full
+		leaderboard, ("platform", name) or ("rank", value).
+		"""
+		view = None
+		title = "Top Puyo players"
+		start, stop = 0, cls.page_size
+		for argument in arguments:
+			name = argument.casefold()
+			if name in utils.platform_name_mapping:
+				view = ("platform", name)
+				title = f"Top Puyo players on {utils.format_platform_name(name)}"
+			elif name in cls.rank_mapping:
+				rank = cls.rank_mapping[name]
+				view = ("rank", rank.value)
+				title = f"Top {rank.name} Puyo players"
+			elif "-" in name:
+				start, stop = cls.parse_range(name)
+			elif name.isdigit():
+				page = int(name)
+				if page < 1:
+					raise Exception("Page numbers start at 1.")
+				start = (page - 1) * cls.page_size
+				stop = start + cls.page_size
+			else:
+				raise Exception(
+					f"`{argument}` is not a platform, a rank, a page number "
+					"or a range of positions."
+				)
+		return view, title, start, stop
+
+	async def get_snapshot(self):
+		"""
+		:return: All ranked players in leaderboard order. The list is reused
+		until the rank index changes, and then only the rows of the players
+		that changed are fetched again.
+		"""
+		async with self.snapshot_lock:
+			if self.snapshot_version != rank_index.version:
+				version = rank_index.version
+				changes = (
+					None if self.snapshot_version is None else
+					rank_index.get_changes(self.snapshot_version)
+				)
+				if changes is None:
+					rows = await database.fetchall(queries.ranked_players)
+					self.players = {row["id"]: row for row in rows}
+				elif len(changes) != 0:
+					rows = await database.fetchall(queries.players_by_ids, (json.dumps(changes),))
+					for player_id in changes:
+						self.players.pop(player_id, None)
+					self.players.update(
+						(row["id"], row) for row in rows if row["id"] in rank_index.keys
+					)
+				order = rank_index.page(0, len(rank_index))
+				self.snapshot = [self.players[i] for i in order if i in self.players]
+				self.snapshot_version = version
+				# The leaderboard is the only view that asks for changes.
+				rank_index.forget_changes(version)
+				self.views.clear()
+				self.pages.clear()
+			return self.snapshot
+
+	def get_view(self, snapshot, view):
+		if view not in self.views:
+			if view is None:
+				self.views[view] = snapshot
+			elif view[0] == "platform":
+				self.views[view] = [
+					player for player in snapshot
+					if view[1] in player["platforms"].split()
+				]
+			else:
+				self.views[view] = [
+					player for player in snapshot
+					if utils.get_rank_value(player["rating_mu"]) == view[1]
+				]
+		return self.views[view]
+
+	async def render_page(self, players, title, start, stop):
+		entries = players[start:stop]
+		# Resolve all missing names at once rather than one after another.
+		names = await asyncio.gather(*(
+			self.get_player_name(player) for player in entries
+		))
+		message = f"**{title}**"
+		for index, (player, name) in enumerate(zip(entries, names), start + 1):
 			message += (
 				"\n" + str(index) + ". " +
-				utils.escape_markdown(await self.get_player_name(player)) +
+				utils.escape_markdown(name) +
 				" | " + str(int(player["rating_mu"])) + " \u00B1 " + str(int(2 * player["rating_phi"])) +
 				" | " + utils.get_rank(player["rating_mu"]).name
 			)
+		message += f"\n_Positions {start + 1}\u2013{start + len(entries)} of {len(players)}_"
+		return message
+
+	@commands.command(
+		name="leaderboard",
+		usage="[platform or rank] [page or positions]",
+		help=(
+			"`{0}leaderboard [platform or rank] [page or positions]`\n"
+			"See the current top players in the system. You can limit the "
+			"list to a platform (PC, Switch, PS4) or a rank, and choose a "
+			"page number or a range of positions such as `51-60`."
+		)
+	)
+	async def leaderboard(self, ctx, *arguments):
+		try:
+			view, title, start, stop = self.parse_arguments(arguments)
+		except Exception as e:
+			await ctx.send(str(e))
+			return
+		players = self.get_view(await self.get_snapshot(), view)
+		if len(players) == 0:
+			await ctx.send(
+				"There are no players with ranks at the moment, so no leaders to display."
+				if view is None else
+				"There are no ranked players there at the moment."
+			)
+			return
+		if start >= len(players):
+			await ctx.send(f"There are only {len(players)} ranked players there at the moment.")
+			return
+
+		version = self.snapshot_version
+		key = (view, start, stop)
+		page = self.pages.get(key)
+		if page is not None and page[1] > time.monotonic():
+			message = page[0]
+		else:
+			message = await self.render_page(players, title, start, stop)
+			if version == self.snapshot_version:
+				self.pages[key] = (message, time.monotonic() + self.page_lifetime)
 		await ctx.send(message)
 
 	@leaderboard.error
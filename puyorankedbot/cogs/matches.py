@@ -67,6 +67,9 @@ class Matches(commands.Cog):
 
 		data = match_manager.player_map[ctx.author.id]
 		match = data[0]
+		if match.resolving:
+			await ctx.send("Your match is already being recorded.")
+			return
 		if data[1]:
 			score1, score2 = score2, score1
 
@@ -83,21 +86,18 @@ class Matches(commands.Cog):
 				await ctx.send("Nothing changed, the scores are still the same.")
 				return
 			else:
-				match.confirm_status == new_status
+				match.confirm_status = new_status
 				if new_status == 3:
 					await match_manager.process_match_complete(match)
-					match_manager.confirming_matches.remove(match)
+				else:
+					await match.save_state("confirm")
 		else:
 			match.player1_score = score1
 			match.player2_score = score2
-
-			if match.confirming_timestamp is None:
-				match_manager.pending_matches.remove(match)
-			else:
-				match_manager.confirming_matches.remove(match)
-			match_manager.confirming_matches.append(match)
 			match.confirming_timestamp = datetime.now().timestamp()
 			match.confirm_status = 1 if data[1] else 2
+			await match.save_state("report")
+			match_manager.schedule_match(match)
 
 			embed = discord.Embed(
 				type="rich",
@@ -141,6 +141,9 @@ class Matches(commands.Cog):
 			return
 		data = match_manager.player_map[ctx.author.id]
 		match = data[0]
+		if match.resolving:
+			await ctx.send("Your match is already being recorded.")
+			return
 		if match.confirming_timestamp is not None:
 			await ctx.send("Cannot cancel the match since scores are already submitted.")
 			return
@@ -150,11 +153,13 @@ class Matches(commands.Cog):
 			return
 		else:
 			if new_status == 3:
-				await match_manager.cleanup_for_match(match)
-				match_manager.pending_matches.remove(match)
-				await ctx.send("The match has been cancelled.")
+				if await match_manager.cleanup_for_match(match):
+					await ctx.send("The match has been cancelled.")
+				else:
+					await ctx.send("Your match is already being recorded.")
 			else:
 				match.cancel_status = new_status
+				await match.save_state("cancel")
 				await ctx.send(
 					f"<@!{ctx.author.id}> is requesting the match be cancelled. "
 					f"<@!{match.player1 if data[1] else match.player2}> can use "
@@ -1,8 +1,33 @@
 from discord.ext import commands
 
 from core import utils
-from core.database import database
+from core import database
+from core import queries
+from core.event_log import event_log
 from core.match_manager import matchfinder, match_manager
+from core.rank_index import rank_index
+from core.role_sync import role_sync, compute_transitions, queue_transitions
+
+
+def insert_player(connection, player_id, platforms):
+	database.run_statement(connection, queries.insert_player, (player_id, platforms))
+	queue_transitions(connection, compute_transitions(((player_id, None, None, 1500, 350),)))
+
+def add_platforms(connection, player_id, platforms, mu, phi):
+	database.run_statement(connection, queries.set_platforms, (platforms, player_id))
+	queue_transitions(connection, compute_transitions(((player_id, None, None, mu, phi),)))
+
+def clear_player(connection, player_id, mu, phi):
+	database.run_statement(connection, queries.clear_player, (player_id,))
+	queue_transitions(connection, compute_transitions(((player_id, mu, phi, None, None),)))
+
+def remove_platforms(connection, player_id, remaining_platforms, platforms):
+	database.run_statement(
+		connection, queries.set_platforms,
+		(" ".join(remaining_platforms), player_id)
+	)
+	for platform in platforms:
+		database.run_statement(connection, queries.set_username[platform], (None, player_id))
 
 
 class Registration(commands.Cog):
@@ -54,18 +79,12 @@ class Registration(commands.Cog):
 
 		platform_names = ", ".join(utils.format_platform_name(platform) for platform in platforms)
 			
-		player = database.execute(
-			"SELECT platforms, rating_mu, rating_phi FROM players WHERE id = ?",
-			(ctx.author.id,)
-		).fetchone()
+		player = await database.fetchone(queries.player_registration, (ctx.author.id,))
 		if player is None:
 			# First time registering.
-			database.execute(
-				"INSERT INTO players (id, platforms) VALUES (?, ?)",
-				(ctx.author.id, " ".join(platforms))
-			)
-			database.commit()
-			await utils.update_role(ctx.author.id, None, None, 1500, 350)
+			await database.write(insert_player, ctx.author.id, " ".join(platforms))
+			event_log.append("register", id=ctx.author.id, platforms=" ".join(platforms))
+			role_sync.notify()
 			await ctx.send(f"Signed up for {platform_names}.")
 		else:
 			# Already registered.
@@ -79,12 +98,13 @@ class Registration(commands.Cog):
 				await ctx.send(f"You're already signed up for {platform_names}.")
 				return
 			else:
-				database.execute(
-					"UPDATE players SET platforms = ? WHERE id = ?",
-					(" ".join(player_platforms), ctx.author.id)
+				await database.write(
+					add_platforms, ctx.author.id, " ".join(player_platforms),
+					player["rating_mu"], player["rating_phi"]
 				)
-				database.commit()
-				await utils.update_role(ctx.author.id, None, None, player["rating_mu"], player["rating_phi"])
+				event_log.append("register", id=ctx.author.id, platforms=" ".join(player_platforms))
+				rank_index.update(ctx.author.id, player["rating_mu"], player["rating_phi"])
+				role_sync.notify()
 				await ctx.send(f"Signed up for {platform_names}.")
 
 	@register.error
@@ -126,10 +146,7 @@ class Registration(commands.Cog):
 			return
 		platform_names = ", ".join(utils.format_platform_name(platform) for platform in platforms)
 
-		player = database.execute(
-			"SELECT platforms, rating_mu, rating_phi FROM players WHERE id = ? AND platforms <> ''",
-			(ctx.author.id,)
-		).fetchone()
+		player = await database.fetchone(queries.player, (ctx.author.id,))
 		if player is None:
 			await ctx.send(f"You are not signed up here, no worries.")
 		else:
@@ -139,23 +156,31 @@ class Registration(commands.Cog):
 				[platform for platform in old_player_platforms if platform not in platforms]
 			)
 			if len(new_player_platforms) != len(old_player_platforms):
-				platform_nullify = ", ".join(f"username_{platform} = NULL" for platform in platforms)
 				zenkeshita = nuke or len(new_player_platforms) == 0
-				database.execute(
-					"""
-					UPDATE players SET
-						platforms = "",
-						display_name = NULL,
-						username_pc = NULL,
-						username_switch = NULL,
-						username_ps4 = NULL
-					WHERE id = :id
-					"""
+				if zenkeshita:
+					await database.write(
+						clear_player, ctx.author.id, player["rating_mu"], player["rating_phi"]
+					)
+				else:
+					await database.write(
+						remove_platforms, ctx.author.id, new_player_platforms, platforms
+					)
+				event_log.append(
+					"unregister",
+					id=ctx.author.id,
+					fields={
+						"platforms": "",
+						"display_name": None,
+						"username_pc": None,
+						"username_switch": None,
+						"username_ps4": None
+					}
 					if zenkeshita else
-					f"UPDATE players SET platforms = :platforms, {platform_nullify} WHERE id = :id",
-					{"platforms": " ".join(new_player_platforms), "id": ctx.author.id}
+					{
+						"platforms": " ".join(new_player_platforms),
+						**{f"username_{platform}": None for platform in platforms}
+					}
 				)
-				database.commit()
 				await ctx.send(
 					"Unregistered from __all__ platforms. You are no longer in the system."
 					if nuke else
@@ -163,7 +188,10 @@ class Registration(commands.Cog):
 					(" __You are no longer in the system.__" if len(new_player_platforms) == 0 else "")
 				)
 				if zenkeshita:
-					await utils.update_role(ctx.author.id, player["rating_mu"], player["rating_phi"], None, None)
+					rank_index.remove(ctx.author.id)
+					role_sync.notify()
+				else:
+					rank_index.touch(ctx.author.id)
 			else:
 				await ctx.send(f"You are not signed up for {platform_names}.")
 
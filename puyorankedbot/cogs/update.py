@@ -1,7 +1,10 @@
 from discord.ext import commands
 
 from core import utils
-from core.database import database
+from core import database
+from core import queries
+from core.event_log import event_log
+from core.rank_index import rank_index
 
 
 class Update(commands.Cog):
@@ -47,26 +50,22 @@ class Update(commands.Cog):
 	)
 	async def update_displayname(self, ctx, *name):
 		name = " ".join(name).strip()
-		if database.execute(
-			"SELECT EXISTS (SELECT 1 FROM players WHERE id = ? AND platforms <> '')",
-			(ctx.author.id,)
-		).fetchone()[0] == 0:
+		if (await database.fetchone(queries.player_registered, (ctx.author.id,)))[0] == 0:
 			await ctx.send("You are not registered yet.")
 			return
 		if name == "":
-			database.execute("UPDATE players SET display_name = NULL WHERE id = ?", (ctx.author.id,))
-			database.commit()
+			await database.execute(queries.set_display_name, (None, ctx.author.id))
+			event_log.append("update_player", id=ctx.author.id, fields={"display_name": None})
+			rank_index.touch(ctx.author.id)
 			await ctx.send("Cleared display name.")
 		else:
-			if database.execute(
-				"SELECT EXISTS (SELECT 1 FROM players WHERE display_name = ?)",
-				(name,)
-			).fetchone()[0] == 1:
+			if (await database.fetchone(queries.display_name_taken, (name,)))[0] == 1:
 				await ctx.send(
 					f"The display name \"{utils.escape_markdown(name)}\" is already in use by another player.")
 				return
-			database.execute("UPDATE players SET display_name = ? WHERE id = ?", (name, ctx.author.id))
-			database.commit()
+			await database.execute(queries.set_display_name, (name, ctx.author.id))
+			event_log.append("update_player", id=ctx.author.id, fields={"display_name": name})
+			rank_index.touch(ctx.author.id)
 			await ctx.send(f"Display name set to \"{utils.escape_markdown(name)}\".")
 
 	@update.command(
@@ -88,10 +87,7 @@ class Update(commands.Cog):
 			)
 			return
 		name = " ".join(name).strip()
-		player = database.execute(
-			"SELECT platforms FROM players WHERE id = ? AND platforms <> ''",
-			(ctx.author.id,)
-		).fetchone()
+		player = await database.fetchone(queries.player_platforms, (ctx.author.id,))
 		if player is None:
 			await ctx.send("You are not registered yet.")
 			return
@@ -99,21 +95,18 @@ class Update(commands.Cog):
 			await ctx.send(f"You are not signed up for {utils.format_platform_name(platform)}.")
 			return
 		if name == "":
-			database.execute(f"UPDATE players SET username_{platform} = NULL WHERE id = ?", (ctx.author.id,))
-			database.commit()
+			await database.execute(queries.set_username[platform], (None, ctx.author.id))
+			event_log.append("update_player", id=ctx.author.id, fields={f"username_{platform}": None})
 			await ctx.send(f"Cleared username for {utils.format_platform_name(platform)}.")
 		else:
-			if database.execute(
-				f"SELECT EXISTS (SELECT 1 FROM players WHERE username_{platform} = ?)",
-				(name,)
-			).fetchone()[0] == 1:
+			if (await database.fetchone(queries.username_taken[platform], (name,)))[0] == 1:
 				await ctx.send(
 					f"The username \"{utils.escape_markdown(name)}\" on "
 					f"{utils.format_platform_name(platform)} is already in use by another player."
 				)
 				return
-			database.execute(f"UPDATE players SET username_{platform} = ? WHERE id = ?", (name, ctx.author.id))
-			database.commit()
+			await database.execute(queries.set_username[platform], (name, ctx.author.id))
+			event_log.append("update_player", id=ctx.author.id, fields={f"username_{platform}": name})
 			await ctx.send(
 				f"Username on {utils.format_platform_name(platform)} set to "
 				f"\"{utils.escape_markdown(name)}\"."
@@ -1,38 +1,147 @@
 import json
 import os
+import threading
+import time
+from logger import logger
+
+path = "../config.json"
+# Seconds between two checks of the file's modification time.
+check_interval = 1
 
 
 class ConfigNotFoundException(Exception):
 	pass
 
 
-def get_config(key):
+class ConfigTypeException(Exception):
+	pass
+
+
+class ConfigCache:
+	"""
+	The parsed configuration file. The file is parsed again when its
+	modification time or size changes, which is checked at most every
+	check_interval seconds, so that edits apply without a restart.
+	"""
+	def __init__(self):
+		self.values = None
+		self.signature = None
+		# The signature of the file the last time it couldn't be parsed, so that
+		# the warning isn't repeated on every check.
+		self.failed_signature = None
+		self.next_check = 0
+		# Settings are read from the database and backup threads too. A reload
+		# assigns values and signature separately, so only one thread reloads at
+		# a time, the others keep the current values meanwhile.
+		self.lock = threading.Lock()
+
+	def get_values(self):
+		now = time.monotonic()
+		# Without values yet, there is nothing to return but to wait.
+		if now >= self.next_check and self.lock.acquire(blocking=self.values is None):
+			try:
+				# Another thread may have reloaded while this one waited.
+				if now >= self.next_check:
+					# Before the reload, so that an invalidate during it isn't lost.
+					self.next_check = now + check_interval
+					try:
+						self.reload()
+					except BaseException:
+						self.next_check = 0
+						raise
+			finally:
+				self.lock.release()
+		return self.values
+
+	def reload(self):
+		try:
+			stat = os.stat(path)
+		except FileNotFoundError:
+			# Editors may replace the file by deleting it first.
+			if self.values is None:
+				raise ConfigNotFoundException("config.json is missing")
+			return
+		signature = (stat.st_mtime_ns, stat.st_size)
+		if signature == self.signature:
+			return
+		try:
+			with open(path, "r") as file_obj:
+				values = json.load(file_obj)
+		except ValueError as e:
+			if self.values is None:
+				raise
+			# The signature isn't kept, so the file is parsed again on the next
+			# check, in case it was read while being written.
+			if signature != self.failed_signature:
+				self.failed_signature = signature
+				logger.warning(f"config.json could not be parsed, the previous values are kept: {e}")
+			return
+		if self.values is not None:
+			logger.info("config.json reloaded.")
+		# Readers get either the old or the new values, never a mix of both.
+		self.values = values
+		self.signature = signature
+
+	def invalidate(self):
+		self.next_check = 0
+
+cache = ConfigCache()
+
+no_default = object()
+
+def get_config(key, default=no_default):
 	"""
 	Gets the key in the configuration file's value.
 	:param key: A valid key in the config.json.
-	:return value: The value of the key.
+	:param default: Returned if the key is not in the config.json. Optional keys
+	have defaults so that older configuration files keep working.
+	:return value: The value of the key. Lists and dictionaries are shared and
+	must not be modified.
 	"""
-	if os.path.exists("../config.json"):
-		with open("../config.json", "r") as file_obj:
-			json_obj = json.load(file_obj)
-			return json_obj[key]
-	else:
-		raise ConfigNotFoundException("config.json is missing")
+	values = cache.get_values()
+	if default is not no_default and key not in values:
+		return default
+	return values[key]
+
+def get_typed(key, types, default):
+	value = get_config(key, default)
+	# bool is a subclass of int but never meant as a number here.
+	if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+		raise ConfigTypeException(
+			f"{key} in config.json should be {' or '.join(t.__name__ for t in types)}, "
+			f"not {type(value).__name__}"
+		)
+	return value
+
+def get_int(key, default=no_default):
+	return get_typed(key, (int,), default)
+
+def get_float(key, default=no_default):
+	"""
+	Integers are accepted and converted.
+	"""
+	return float(get_typed(key, (int, float), default))
+
+def get_bool(key, default=no_default):
+	return get_typed(key, (bool,), default)
 
 
 def set_config(key, value):
 	"""
-	Sets a key in the configuration file to the value.
+	Sets a key in the configuration file to the value. The file is replaced at
+	once, so that it is never read half written.
 	:param key: A valid key in the config.json.
 	:param value: The value that is going to be set.
 	:return: None
 	"""
-	if os.path.exists("../config.json"):
-		with open("../config.json", "r") as file_obj:
+	if os.path.exists(path):
+		with open(path, "r") as file_obj:
 			json_obj = json.load(file_obj)
 		json_obj[key] = value
-		with open("../config.json", "w") as file_obj:
+		with open(path + ".tmp", "w") as file_obj:
 			json.dump(json_obj, file_obj)
+		os.replace(path + ".tmp", path)
+		cache.invalidate()
 	else:
 		raise ConfigNotFoundException("config.json is missing")
 
@@ -53,10 +162,10 @@ def create_config():
 	if the configuration file does not exist.
 	:return: None
 	"""
-	if os.path.exists("../config.json"):
+	if os.path.exists(path):
 		return
 	else:
-		with open("../config.json", "w") as file_obj:
+		with open(path, "w") as file_obj:
 			print("Configuration file not found, supply the following:")
 			data = {
 				"token": input("Bot token: "),
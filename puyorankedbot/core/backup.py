@@ -0,0 +1,104 @@
+# This module keeps rotated backups of the database. Backups are made on their
+# own thread from a read-only connection, so they never hold up the event loop
+# or the writer thread, and are skipped when nothing changed since the last one.
+
+import asyncio
+import gzip
+import os
+import shutil
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from logger import logger
+from config import get_int, get_float, get_bool
+from core import database
+from core import utils
+
+class Backup:
+	"""
+	The newest backup is at path, older generations at path.1, path.2, and so on,
+	each with .gz appended when compressed.
+	"""
+	def __init__(self, path="../data_backup.db3"):
+		self.path = path
+		self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database-backup")
+		# Only touched from the backup thread.
+		self.connection = None
+		self.data_version = None
+		self.running = False
+
+	def setup(self):
+		if self.running: return
+		self.running = True
+		asyncio.create_task(self.run())
+
+	async def run(self):
+		while True:
+			try:
+				await asyncio.get_running_loop().run_in_executor(self.executor, self.make_backup)
+			except Exception as e:
+				utils.log_error(e)
+			await asyncio.sleep(get_float("backup_interval"))
+
+	def make_backup(self):
+		"""
+		Copies the database unless it is unchanged since the last backup.
+		:return: True if a backup was written.
+		"""
+		if self.connection is None:
+			# PRAGMA data_version only tells about changes made by other
+			# connections since the previous query on the same connection, so this
+			# one is kept open.
+			self.connection = database.connect(read_only=True)
+		data_version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+		if data_version == self.data_version and os.path.exists(self.get_path(0)):
+			logger.debug("Database unchanged, backup skipped.")
+			return False
+
+		compress = get_bool("backup_compress", False)
+		temporary_path = self.path + ".tmp"
+		destination = sqlite3.connect(temporary_path)
+		try:
+			# All the pages in a single step, which copies one consistent snapshot
+			# instead of restarting whenever the database is written to. Readers
+			# don't block the writer in WAL mode.
+			self.connection.backup(destination, pages=-1)
+		finally:
+			destination.close()
+		if compress:
+			with open(temporary_path, "rb") as source, gzip.open(temporary_path + ".gz", "wb") as target:
+				shutil.copyfileobj(source, target)
+			os.remove(temporary_path)
+			temporary_path += ".gz"
+
+		self.rotate(compress)
+		os.replace(temporary_path, self.get_path(0, compress))
+		self.remove_other_format(compress)
+		self.data_version = data_version
+		logger.info("Database backup written.")
+		return True
+
+	def get_path(self, generation, compress=None):
+		if compress is None:
+			compress = get_bool("backup_compress", False)
+		return (
+			self.path + (f".{generation}" if generation != 0 else "") +
+			(".gz" if compress else "")
+		)
+
+	def rotate(self, compress):
+		generations = get_int("backup_generations", 3)
+		for generation in range(generations - 1, 0, -1):
+			if os.path.exists(self.get_path(generation - 1, compress)):
+				os.replace(self.get_path(generation - 1, compress), self.get_path(generation, compress))
+
+	def remove_other_format(self, compress):
+		"""
+		Removes the generations left from before backup_compress was changed,
+		which rotate doesn't touch.
+		"""
+		for generation in range(get_int("backup_generations", 3)):
+			path = self.get_path(generation, not compress)
+			if os.path.exists(path):
+				os.remove(path)
+
+backup = Backup()
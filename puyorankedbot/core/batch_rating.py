@@ -0,0 +1,156 @@
+# This module computes Glicko-2 rating periods in bulk. All the games a player
+# played during a period are rated together, against the ratings of their
+# opponents at the start of the period, as described in the Glicko-2 paper:
+# http://www.glicko.net/glicko/glicko2.pdf
+
+import math
+
+# The conversion factor between the Glicko scale and the Glicko-2 scale.
+scale = 173.7178
+
+class BatchRating:
+	"""
+	The shared environment of the rating computations. Ratings are given and
+	returned as (mu, phi, sigma) on the Glicko scale used by the database,
+	where a new player has (1500, 350, 0.06).
+	"""
+	def __init__(self, tau=1.0, epsilon=0.000001):
+		"""
+		:param tau: Constrains the change of the volatility over time.
+		:param epsilon: The convergence tolerance of the volatility.
+		"""
+		self.tau = tau
+		self.epsilon = epsilon
+
+	def rate_period(self, ratings, games):
+		"""
+		:param ratings: A dictionary of player ID to rating at the start of the
+		period. Every player of the games has to be in it.
+		:param games: An iterable of (player1, player2, score1), where score1 is 1
+		if player 1 won, 0 if they lost and 0.5 for a draw.
+		:return: A dictionary of player ID to new rating, for the players who
+		played during the period.
+		"""
+		# Per player columns, indexed by the order of first appearance.
+		index = {}
+		player_ids = []
+		mus = []
+		phis = []
+		impacts = []
+		variance_inverses = []
+		improvements = []
+		for player1, player2, score1 in games:
+			for player_id in (player1, player2):
+				if player_id not in index:
+					index[player_id] = len(player_ids)
+					player_ids.append(player_id)
+					mu, phi, _ = ratings[player_id]
+					phi = phi / scale
+					mus.append((mu - 1500) / scale)
+					phis.append(phi)
+					impacts.append(1 / math.sqrt(1 + 3 * phi**2 / math.pi**2))
+					variance_inverses.append(0.0)
+					improvements.append(0.0)
+			i = index[player1]
+			j = index[player2]
+			impact_i = impacts[i]
+			impact_j = impacts[j]
+			difference = mus[i] - mus[j]
+			expected_i = 1 / (1 + math.exp(-impact_j * difference))
+			expected_j = 1 / (1 + math.exp(impact_i * difference))
+			variance_inverses[i] += impact_j**2 * expected_i * (1 - expected_i)
+			variance_inverses[j] += impact_i**2 * expected_j * (1 - expected_j)
+			improvements[i] += impact_j * (score1 - expected_i)
+			improvements[j] += impact_i * (1 - score1 - expected_j)
+
+		return {
+			player_id: self.update(
+				mus[i], phis[i], ratings[player_id][2],
+				variance_inverses[i], improvements[i]
+			)
+			for i, player_id in enumerate(player_ids)
+		}
+
+	def rate_1vs1(self, winner, loser):
+		"""
+		Rates a single game as its own rating period, like
+		glicko2.Glicko2.rate_1vs1 but with tuples.
+		:return: The new ratings of the winner and the loser.
+		"""
+		mu_w = (winner[0] - 1500) / scale
+		phi_w = winner[1] / scale
+		mu_l = (loser[0] - 1500) / scale
+		phi_l = loser[1] / scale
+		impact_w = 1 / math.sqrt(1 + 3 * phi_w**2 / math.pi**2)
+		impact_l = 1 / math.sqrt(1 + 3 * phi_l**2 / math.pi**2)
+		expected_w = 1 / (1 + math.exp(-impact_l * (mu_w - mu_l)))
+		expected_l = 1 / (1 + math.exp(-impact_w * (mu_l - mu_w)))
+		return (
+			self.update(
+				mu_w, phi_w, winner[2],
+				impact_l**2 * expected_w * (1 - expected_w), impact_l * (1 - expected_w)
+			),
+			self.update(
+				mu_l, phi_l, loser[2],
+				impact_w**2 * expected_l * (1 - expected_l), -impact_w * expected_l
+			)
+		)
+
+	def update(self, mu, phi, sigma, variance_inverse, improvement):
+		"""
+		Steps 5 to 8 of the paper, from the sums over the games of a player.
+		:param mu: On the Glicko-2 scale, like phi.
+		:return: The new rating, on the Glicko scale.
+		"""
+		variance = 1 / variance_inverse
+		sigma = self.volatility(phi, sigma, variance, variance * improvement)
+		new_phi = 1 / math.sqrt(1 / (phi**2 + sigma**2) + variance_inverse)
+		new_mu = mu + new_phi**2 * improvement
+		return (new_mu * scale + 1500, new_phi * scale, sigma)
+
+	def rate_inactive(self, rating):
+		"""
+		:return: The rating of a player who didn't play during a period.
+		"""
+		mu, phi, sigma = rating
+		return (mu, math.sqrt((phi / scale)**2 + sigma**2) * scale, sigma)
+
+	def volatility(self, phi, sigma, variance, delta):
+		"""
+		Step 5 of the paper, with the Illinois algorithm. The arguments are on the
+		Glicko-2 scale.
+		:return: The new volatility.
+		"""
+		a = math.log(sigma**2)
+		tau_square = self.tau**2
+		base = phi**2 + variance
+		delta_square = delta**2
+		def f(x):
+			exponential = math.exp(x)
+			return (
+				exponential * (delta_square - base - exponential) /
+				(2 * (base + exponential)**2) -
+				(x - a) / tau_square
+			)
+
+		A = a
+		if delta_square > base:
+			B = math.log(delta_square - base)
+		else:
+			k = 1
+			while f(a - k * self.tau) < 0:
+				k += 1
+			B = a - k * self.tau
+		f_A = f(A)
+		f_B = f(B)
+		while abs(B - A) > self.epsilon:
+			C = A + (A - B) * f_A / (f_B - f_A)
+			f_C = f(C)
+			if f_C * f_B < 0:
+				A, f_A = B, f_B
+			else:
+				f_A /= 2
+			B, f_B = C, f_C
+		return math.exp(A / 2)
+
+batch_rating = BatchRating()
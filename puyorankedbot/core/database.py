@@ -1,6 +1,14 @@
-import sqlite3, datetime, asyncio
-from config import get_config
-from core import utils
+# This module is the data access layer of the bot. All SQLite I/O runs on
+# worker threads so that it never blocks the event loop: writes are queued
+# to a single writer thread, reads are spread over a small pool of read-only
+# connections. The time spent on each statement or transaction is recorded,
+# see get_query_stats.
+
+import sqlite3, datetime, asyncio, threading, os, time, contextvars
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from logger import logger
+from config import get_float
 
 sqlite3.register_converter(
 	"DATETIME",
@@ -32,24 +40,269 @@ def row_factory(cursor, row):
 		d[column[0]] = row[index]
 	return Row(d, tuple(row))
 
-database = sqlite3.connect("../data.db3", detect_types=sqlite3.PARSE_DECLTYPES)
-database.row_factory = row_factory
-
-backup_running = False
-
-def setup_backup():
-	global backup_running
-	if backup_running: return
-	asyncio.create_task(backup())
-	backup_running = True
-
-async def backup():
-	interval = get_config("backup_interval")
-	while True:
-		try:
-			destination = sqlite3.connect("../data_backup.db3")
-			database.backup(destination)
-			destination.close()
-			await asyncio.sleep(interval)
-		except Exception as e:
-			utils.log_error(e)
+path = "../data.db3"
+migrations_path = "../migrations"
+reader_count = 4
+# The statements of core.queries all fit in the statement cache of each
+# connection, so they are only prepared once.
+cached_statements = 256
+
+# Applied to every connection. The journal mode is stored in the database file
+# itself and is set once by migrate().
+pragmas = {
+	"synchronous": "NORMAL",
+	"mmap_size": 256 * 1024 * 1024,
+	"cache_size": -64 * 1024, # Negative means KiB instead of pages.
+	"temp_store": "MEMORY"
+}
+
+# Each worker thread owns exactly one connection, stored here.
+thread_data = threading.local()
+
+def connect(read_only=False):
+	"""
+	Opens a new connection to the database file.
+	:param read_only: Whether the connection should refuse writes.
+	:return: The sqlite3 connection.
+	"""
+	connection = sqlite3.connect(
+		f"file:{path}?mode=ro" if read_only else path,
+		uri=read_only,
+		detect_types=sqlite3.PARSE_DECLTYPES,
+		cached_statements=cached_statements
+	)
+	for name, value in pragmas.items():
+		connection.execute(f"PRAGMA {name} = {value}")
+	connection.row_factory = row_factory
+	return connection
+
+def migrate():
+	"""
+	Brings the schema up to date. Every file in the migrations directory is
+	named <number>_<description>.sql and is applied in its own transaction if
+	its number is greater than the database's user_version, which is then set
+	to that number.
+	This also creates the database file if it does not exist yet.
+	"""
+	connection = sqlite3.connect(path)
+	connection.execute("PRAGMA journal_mode = WAL")
+	version = connection.execute("PRAGMA user_version").fetchone()[0]
+	migrations = sorted(
+		(int(file_name.split("_", 1)[0]), file_name)
+		for file_name in os.listdir(migrations_path)
+		if file_name.endswith(".sql")
+	)
+	try:
+		for number, file_name in migrations:
+			if number <= version: continue
+			logger.info(f"Applying database migration {file_name}.")
+			with open(os.path.join(migrations_path, file_name), "r") as f:
+				script = f.read()
+			connection.executescript(
+				f"BEGIN;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;"
+			)
+			version = number
+	finally:
+		connection.close()
+
+class Timing:
+	"""
+	Counts the durations of a statement or transaction in buckets.
+	"""
+	bounds = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+
+	def __init__(self):
+		self.counts = [0] * (len(self.bounds) + 1)
+		self.total = 0
+		self.maximum = 0
+
+	def add(self, duration):
+		"""
+		:param duration: In seconds.
+		"""
+		self.counts[bisect_left(self.bounds, duration)] += 1
+		self.total += duration
+		self.maximum = max(self.maximum, duration)
+
+	def to_dict(self):
+		"""
+		:return: The number of runs per bucket, keyed by the upper bound of the
+		bucket in seconds, along with the number of runs, their total, mean and
+		maximum duration.
+		"""
+		count = sum(self.counts)
+		return {
+			"buckets": dict(zip(self.bounds + (float("inf"),), self.counts)),
+			"count": count,
+			"total": self.total,
+			"mean": self.total / count if count != 0 else 0,
+			"max": self.maximum
+		}
+
+# Timings by name, filled by the worker threads.
+timings = {}
+timings_lock = threading.Lock()
+
+def record_timing(name, duration):
+	with timings_lock:
+		timing = timings.get(name)
+		if timing is None:
+			timing = timings[name] = Timing()
+		timing.add(duration)
+	if duration >= get_slow_query_threshold():
+		logger.warning(f"Slow query {name}: {duration * 1000:.0f} ms.")
+
+def get_slow_query_threshold():
+	# This runs after the statement, even after a commit, so a bad setting must
+	# not turn into an error of the statement.
+	try:
+		return get_float("slow_query_threshold", 0.1)
+	except Exception:
+		return 0.1
+
+def get_query_stats():
+	"""
+	:return: The timings of every statement and transaction, see Timing.to_dict,
+	by name, the most time consuming first. Durations count the time spent in
+	SQLite, not the time waiting for a worker thread.
+	"""
+	with timings_lock:
+		stats = {name: timing.to_dict() for name, timing in timings.items()}
+	return dict(sorted(stats.items(), key=lambda item: -item[1]["total"]))
+
+def open_thread_connection(read_only):
+	thread_data.connection = connect(read_only)
+
+writer = ThreadPoolExecutor(
+	max_workers=1,
+	thread_name_prefix="database-writer",
+	initializer=open_thread_connection,
+	initargs=(False,)
+)
+readers = ThreadPoolExecutor(
+	max_workers=reader_count,
+	thread_name_prefix="database-reader",
+	initializer=open_thread_connection,
+	initargs=(True,)
+)
+
+# The journal sequence of the last write transaction of the current task, see
+# core.event_log.
+last_sequence = contextvars.ContextVar("last_sequence", default=None)
+
+def run_transaction(name, func, args):
+	"""
+	:return: The return value of func and the journal sequence of the
+	transaction.
+	"""
+	connection = thread_data.connection
+	start = time.perf_counter()
+	try:
+		result = func(connection, *args)
+		connection.execute("UPDATE journal_state SET sequence = sequence + 1")
+		sequence = connection.execute("SELECT sequence FROM journal_state").fetchone()[0]
+		connection.commit()
+		return result, sequence
+	except BaseException:
+		connection.rollback()
+		raise
+	finally:
+		record_timing(name, time.perf_counter() - start)
+
+def run_statement(connection, query, parameters=()):
+	"""
+	Executes a statement of core.queries inside the function of a write or a
+	read, and records its time under the name of the statement.
+	:return: The cursor.
+	"""
+	start = time.perf_counter()
+	try:
+		return connection.execute(query.sql, parameters)
+	finally:
+		record_timing(query.name, time.perf_counter() - start)
+
+def run_statements(connection, query, parameters):
+	"""
+	The same as run_statement, for every parameter set.
+	"""
+	start = time.perf_counter()
+	try:
+		return connection.executemany(query.sql, parameters)
+	finally:
+		record_timing(query.name, time.perf_counter() - start)
+
+def run_read(name, func, args):
+	start = time.perf_counter()
+	try:
+		return func(thread_data.connection, *args)
+	finally:
+		record_timing(name, time.perf_counter() - start)
+
+async def write(func, *args, name=None):
+	"""
+	Runs a function on the writer thread as a single transaction. The
+	transaction is committed if the function returns and rolled back if it
+	raises.
+	:param func: Called as func(connection, *args).
+	:param name: The name of the transaction in the timings, the name of func
+	by default.
+	:return: The return value of func.
+	"""
+	result, sequence = await asyncio.get_running_loop().run_in_executor(
+		writer, run_transaction, name or func.__qualname__, func, args
+	)
+	last_sequence.set(sequence)
+	return result
+
+async def read(func, *args, name=None):
+	"""
+	Runs a function on one of the read-only connections.
+	:param func: Called as func(connection, *args).
+	:param name: The name of the read in the timings, the name of func by
+	default.
+	:return: The return value of func.
+	"""
+	return await asyncio.get_running_loop().run_in_executor(
+		readers, run_read, name or func.__qualname__, func, args
+	)
+
+async def fetchone(query, parameters=()):
+	"""
+	:param query: A statement of core.queries.
+	:return: The first row of the query result, or None if there is none.
+	"""
+	return await read(
+		lambda connection: connection.execute(query.sql, parameters).fetchone(),
+		name=query.name
+	)
+
+async def fetchall(query, parameters=()):
+	"""
+	:param query: A statement of core.queries.
+	:return: A list of all rows of the query result.
+	"""
+	return await read(
+		lambda connection: connection.execute(query.sql, parameters).fetchall(),
+		name=query.name
+	)
+
+async def execute(query, parameters=()):
+	"""
+	Executes a writing statement and commits it.
+	:param query: A statement of core.queries.
+	:return: The rowid of the last inserted row.
+	"""
+	return await write(
+		lambda connection: connection.execute(query.sql, parameters).lastrowid,
+		name=query.name
+	)
+
+async def executemany(query, parameters):
+	"""
+	Executes a writing statement for every parameter set in a single transaction.
+	:param query: A statement of core.queries.
+	"""
+	await write(
+		lambda connection: connection.executemany(query.sql, parameters),
+		name=query.name
+	)
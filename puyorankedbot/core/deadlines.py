@@ -0,0 +1,102 @@
+# This module contains a scheduler that runs a callback when the deadlines of
+# keys pass, such as the timeouts of pending matches.
+
+import asyncio
+import heapq
+import time
+from itertools import count
+from core import utils
+
+class DeadlineScheduler:
+	"""
+	Keeps the deadlines in a heap. Cancelled or rescheduled keys are left in the
+	heap and skipped when they reach the top, so that scheduling and cancelling
+	take O(log n) and O(1). The scheduler sleeps until the earliest deadline
+	instead of polling.
+	"""
+	def __init__(self, callback):
+		"""
+		:param callback: An async function called with the list of keys whose
+		deadline passed. Keys that become due while it runs are passed to the
+		next call, so a backlog is handled in batches.
+		"""
+		self.callback = callback
+		self.heap = []
+		self.entries = {}
+		self.sequence = count()
+		self.wakeup = None
+		self.running = False
+
+	def setup(self):
+		if self.running: return
+		self.running = True
+		self.wakeup = asyncio.Event()
+		asyncio.create_task(self.run())
+
+	def schedule(self, key, deadline):
+		"""
+		Sets the deadline of a key, replacing the previous one if there is one.
+		:param deadline: A POSIX timestamp, in seconds.
+		"""
+		entry = (deadline, next(self.sequence), key)
+		self.entries[key] = entry
+		heapq.heappush(self.heap, entry)
+		if self.wakeup is not None and self.heap[0] is entry:
+			self.wakeup.set()
+
+	def cancel(self, key):
+		self.entries.pop(key, None)
+
+	def __contains__(self, key):
+		return key in self.entries
+
+	def __len__(self):
+		return len(self.entries)
+
+	def pop_due(self, now):
+		"""
+		:return: The next key whose deadline passed, or None. The key is
+		unscheduled.
+		"""
+		while len(self.heap) != 0:
+			entry = self.heap[0]
+			if self.entries.get(entry[2]) is not entry:
+				heapq.heappop(self.heap)
+				continue
+			if entry[0] > now:
+				return None
+			heapq.heappop(self.heap)
+			self.entries.pop(entry[2])
+			return entry[2]
+		return None
+
+	def next_deadline(self):
+		self.pop_due(float("-inf"))
+		return self.heap[0][0] if len(self.heap) != 0 else None
+
+	async def run(self):
+		while True:
+			self.wakeup.clear()
+			deadline = self.next_deadline()
+			if deadline is None:
+				await self.wakeup.wait()
+				continue
+			delay = deadline - time.time()
+			if delay > 0:
+				try:
+					await asyncio.wait_for(self.wakeup.wait(), delay)
+				except asyncio.TimeoutError:
+					pass
+				continue
+			keys = []
+			now = time.time()
+			key = self.pop_due(now)
+			while key is not None:
+				keys.append(key)
+				key = self.pop_due(now)
+			if len(keys) == 0:
+				continue
+			try:
+				await self.callback(keys)
+			except Exception as e:
+				utils.log_error(e)
@@ -0,0 +1,112 @@
+# This module keeps an append-only journal of every change made to the
+# database, one JSON object per line, so that the database can be rebuilt up
+# to any point in time with tools/replay_events.py. Events carry the values
+# that were written rather than the inputs of the change, so replaying them
+# doesn't depend on the rating code, and the journal sequence of the write
+# transaction, so that a backup knows which events it has. They are written
+# and synced to disk in batches by a background thread.
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from config import get_float
+from core import database
+from core import utils
+
+def encode_value(value):
+	# The same format as the datetime adapter of the database.
+	if isinstance(value, datetime):
+		return value.strftime("%Y-%m-%d %H:%M:%S")
+	raise TypeError(f"Cannot encode {type(value).__name__} in an event.")
+
+class EventLog:
+	"""
+	Every event has a "time" key, a POSIX timestamp, a "sequence" key, the
+	journal sequence of its transaction, and a "type" key, one of:
+	register: id, platforms. A player signed up, or for more platforms.
+	unregister, update_player: id, fields. Columns of a player were set.
+	match_created: message_id, player1, player2, created. created is the time
+	column of the pending match.
+	report, confirm, cancel: message_id and the reporting state columns of the
+	pending match.
+	match_cancelled: message_id.
+	match_recorded: message_id, match. match has the columns of the inserted
+	row of matches.
+	timeout: message_id, ratings. ratings is a list of [id, mu, phi, sigma].
+	decay: c, period_start. The rating period update, up to the period starting
+	at the POSIX time period_start.
+	"""
+	def __init__(self, path="../events.jsonl"):
+		self.path = path
+		self.pending = []
+		self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="event-log")
+		# Only touched from the event log thread.
+		self.file = None
+		self.wakeup = None
+		self.running = False
+
+	def setup(self):
+		if self.running: return
+		self.running = True
+		self.wakeup = asyncio.Event()
+		if len(self.pending) != 0:
+			self.wakeup.set()
+		asyncio.create_task(self.run())
+
+	def append(self, event_type, **data):
+		"""
+		Queues an event. To be called right after the database.write call of the
+		change returns, in the same task, which gives the event the sequence of
+		that transaction.
+		"""
+		self.pending.append({
+			"time": time.time(),
+			"sequence": database.last_sequence.get(),
+			"type": event_type,
+			**data
+		})
+		if self.wakeup is not None:
+			self.wakeup.set()
+
+	async def run(self):
+		while True:
+			await self.wakeup.wait()
+			# The events of a whole interval share a single fsync.
+			await asyncio.sleep(get_float("event_log_flush_interval", 1))
+			self.wakeup.clear()
+			events = self.pending
+			self.pending = []
+			try:
+				await asyncio.get_running_loop().run_in_executor(
+					self.executor, self.write_events, events
+				)
+			except Exception as e:
+				utils.log_error(e)
+				# Retried on the next flush.
+				self.pending[:0] = events
+				self.wakeup.set()
+
+	def write_events(self, events):
+		data = memoryview("".join(
+			json.dumps(event, default=encode_value, separators=(",", ":")) + "\n"
+			for event in events
+		).encode("utf-8"))
+		if self.file is None:
+			# Unbuffered, so that nothing of a failed batch is left to be written
+			# later.
+			self.file = open(self.path, "ab", buffering=0)
+		size = os.fstat(self.file.fileno()).st_size
+		try:
+			while len(data) != 0:
+				data = data[self.file.write(data):]
+			os.fsync(self.file.fileno())
+		except BaseException:
+			# A batch is written whole or not at all, so that its retry doesn't
+			# put events in the journal twice.
+			self.file.truncate(size)
+			raise
+
+event_log = EventLog()
@@ -2,14 +2,27 @@
 
 import discord
 import asyncio
+import heapq
+import json
+import time
+from itertools import count
 from datetime import datetime
-from config import get_config
-from core.database import database
+from logger import logger
+from config import get_config, get_int, get_float
+from core import database
+from core import queries
 from core import utils
 from core.glicko2 import glicko2
 from core import match_message_helper
+from core.rank_index import rank_index
+from core.deadlines import DeadlineScheduler
+from core.event_log import event_log
+from core.role_sync import role_sync, compute_transitions, queue_transitions
+from core.matchmaking import Pool, WaitHistogram, find_optimal_matches
 
 TICK_MARK = '\u2705'
+# Shared by all the rating computations, it holds no state besides its parameters.
+glicko2_env = glicko2.Glicko2()
 
 class Player:
 	"""
@@ -24,8 +37,8 @@ class Player:
 		self.player_id = data["id"]
 		self.mu = data["rating_mu"]
 		self.phi = data["rating_phi"]
-		self.low = Node(True, self, self.mu - 2*self.phi)
-		self.high = Node(False, self, self.mu + 2*self.phi)
+		self.low = self.mu - 2*self.phi
+		self.high = self.mu + 2*self.phi
 		self.platforms = set(data["platforms"].split())
 		self.usernames = [
 			data["username_pc"],
@@ -33,11 +46,22 @@ class Player:
 			data["username_ps4"]
 		]
 		self.resolved = False
-		self.platform_count = 0
+		# The indices of the pools the player is in, with the time they joined.
+		self.queued_platforms = {}
+		# The number of times the window was widened while waiting.
 		self.intervals = 0
 
-	def get_nodes(self):
-		return (self.low, self.high)
+	def get_wait(self, now):
+		return now - min(self.queued_platforms.values())
+
+	def widen(self, step):
+		"""
+		Widens the window of the player by step on each side. The player must not
+		be in any pool while this happens, since the pools are sorted by window.
+		"""
+		self.intervals += 1
+		self.low = self.mu - 2*self.phi - self.intervals*step
+		self.high = self.mu + 2*self.phi + self.intervals*step
 
 	def get_ping(self, pool):
 		username = self.usernames[pool]
@@ -46,36 +70,21 @@ class Player:
 			("" if username is None else f" ({utils.escape_markdown(username)})")
 		)
 
-	def trigger_resolve(self):
-		if self.resolved: return
-		self.matchfinder.mark_player_done(self.player_id)
-		self.resolved = True
-
-class Node:
-	def __init__(self, start, player, value):
-		"""
-		:param start: True if self is a starting node, False if ending node.
-		:param player: The Player object.
-		:param value: The position of the node on the ribbon.
-		"""
-		self.start = start
-		self.player = player
-		self.value = value
-
-	def __lt__(self, that):
-		return (
-			self.value < that.value or
-			(self.value == that.value and self.start and not that.start)
-		)
-
 class Matchfinder:
 	def __init__(self):
 		self.player_map = {}
 		self.done_players = []
-		self.pools = [set() for _ in range(3)]
-		self.current_task = None
-		self.current_task_should_wait = False
-		self.new_task_waiting = False
+		self.pools = [Pool(i) for i in range(3)]
+		self.changes = []
+		self.tick_task = None
+		self.tick_count = 0
+		self.batch_size_total = 0
+		self.max_batch_size = 0
+		# A heap of (time, sequence, player) for the next widening of each window.
+		self.widenings = []
+		self.widening_sequence = count()
+		self.wait_times = WaitHistogram()
+		self.abandoned_wait_times = WaitHistogram()
 		self.running = False
 
 	async def setup(self):
@@ -88,9 +97,12 @@ class Matchfinder:
 			for emoji in utils.guild.emojis
 		}
 		self.emoji_mapping = {}
-		self.platforms = get_config("matchmaking_platforms")
+		# New lists, the ones of the configuration are shared.
+		self.platforms = [
+			[*platform, emoji_mapping[platform[2]]]
+			for platform in get_config("matchmaking_platforms")
+		]
 		for platform in self.platforms:
-			platform.append(emoji_mapping[platform[2]])
 			self.emoji_mapping[platform[2]] = (platform[0], platform[1])
 		self.matchfinding_message = await (
 			utils.bot
@@ -106,6 +118,20 @@ class Matchfinder:
 			await self.matchfinding_message.add_reaction(emoji_mapping[emoji_id])
 		utils.bot.add_listener(self.on_reaction, "on_raw_reaction_add")
 		utils.bot.add_listener(self.on_reaction, "on_raw_reaction_remove")
+		asyncio.create_task(self.widen_loop())
+
+	async def widen_loop(self):
+		# Widened windows are only matched on a tick, so one is needed even when
+		# nobody reacts.
+		next_stats = time.monotonic() + get_float("matchmaking_stats_interval", 3600)
+		while True:
+			await asyncio.sleep(get_float("matchmaking_widen_interval", 30) / 2)
+			now = time.monotonic()
+			if len(self.widenings) != 0 and self.widenings[0][0] <= now:
+				self.schedule_tick()
+			if now >= next_stats:
+				next_stats = now + get_float("matchmaking_stats_interval", 3600)
+				logger.info(f"Matchmaking wait times: {self.get_wait_stats()}")
 
 	async def on_reaction(self, data):
 		if data.user_id == self.bot_id:
@@ -114,156 +140,368 @@ class Matchfinder:
 			return
 		if data.emoji.id not in self.emoji_mapping:
 			return
-		platform_data = self.emoji_mapping[data.emoji.id]
-		if data.event_type == "REACTION_ADD":
-			if data.user_id in match_manager.player_map:
-				await remove_reaction(
-					self.matchfinding_message,
-					data.emoji,
-					await utils.get_member(data.user_id)
+		# Reactions are only recorded here, and processed together on the next tick.
+		self.changes.append((data.user_id, data.emoji, data.event_type == "REACTION_ADD"))
+		self.schedule_tick()
+
+	def schedule_tick(self):
+		if self.tick_task is None:
+			self.tick_task = asyncio.create_task(self.run_tick())
+
+	async def run_tick(self):
+		await asyncio.sleep(get_float("matchmaking_tick_delay", 1))
+		changes, self.changes = self.changes, []
+		try:
+			await self.tick(changes)
+		except Exception as e:
+			utils.log_error(e)
+		finally:
+			self.tick_task = None
+			if len(self.changes) != 0:
+				self.schedule_tick()
+
+	async def tick(self, changes):
+		"""
+		Applies a batch of queue joins and leaves, in the order they happened, and
+		announces the resulting matches.
+		:param changes: A list of (user ID, emoji, True if joining).
+		"""
+		self.tick_count += 1
+		self.batch_size_total += len(changes)
+		self.max_batch_size = max(self.max_batch_size, len(changes))
+		logger.debug(f"Matchmaking tick {self.tick_count}: {len(changes)} changes.")
+
+		new_ids = {
+			user_id for user_id, _, joining in changes
+			if joining and user_id not in self.player_map
+		}
+		rows = [] if len(new_ids) == 0 else await database.fetchall(
+			queries.players_by_ids,
+			(json.dumps(list(new_ids)),)
+		)
+		player_data = {row["id"]: row for row in rows}
+
+		optimal = get_config("matchmaking_mode", "greedy") == "optimal"
+		now = time.monotonic()
+		# In optimal mode, the players joining a pool are only matched at the end.
+		arrivals = [[] for _ in self.pools]
+		rejected = []
+		matches = []
+		for user_id, emoji, joining in changes:
+			platform_data = self.emoji_mapping[emoji.id]
+			pool = self.pools[platform_data[1]]
+			if not joining:
+				player = self.player_map.get(user_id)
+				if player is not None and platform_data[1] in player.queued_platforms:
+					pool.discard(player)
+					if player in arrivals[pool.index]:
+						arrivals[pool.index].remove(player)
+					if len(player.queued_platforms) == 1:
+						if not player.resolved:
+							self.abandoned_wait_times.add(player.get_wait(now))
+						self.player_map.pop(player.player_id)
+					player.queued_platforms.pop(platform_data[1])
+				continue
+			if user_id in match_manager.player_map:
+				rejected.append((user_id, emoji))
+				continue
+			player = self.player_map.get(user_id)
+			if player is None:
+				if user_id not in player_data:
+					rejected.append((user_id, emoji))
+					continue
+				player = Player(player_data[user_id], self)
+			if player.resolved or platform_data[0] not in player.platforms:
+				rejected.append((user_id, emoji))
+				continue
+			if platform_data[1] in player.queued_platforms:
+				continue
+			if len(player.queued_platforms) == 0:
+				heapq.heappush(self.widenings, (
+					now + get_float("matchmaking_widen_interval", 30),
+					next(self.widening_sequence),
+					player
+				))
+			self.player_map[player.player_id] = player
+			player.queued_platforms[platform_data[1]] = now
+			if optimal:
+				arrivals[pool.index].append(player)
+				continue
+			partner = pool.add(player)
+			if partner is not None:
+				self.resolve(partner)
+				self.resolve(player)
+				matches.append(
+					(partner, player, pool.index)
+					if partner.low <= player.low else
+					(player, partner, pool.index)
 				)
-				return
-			if data.user_id in self.player_map:
-				player = self.player_map[data.user_id]
-			else:
-				player_data = database.execute(
-					"SELECT * FROM players WHERE id = ? AND platforms <> ''",
-					(data.user_id,)
-				).fetchone()
-				if player_data is None:
-					await remove_reaction(
-						self.matchfinding_message,
-						data.emoji,
-						await utils.get_member(data.user_id)
+		matches.extend(self.widen_windows(now, arrivals, optimal))
+		if optimal:
+			for match_data in find_optimal_matches(
+				self.pools, arrivals, now,
+				get_float("matchmaking_time_budget", 0.05)
+			):
+				self.resolve(match_data[0])
+				self.resolve(match_data[1])
+				matches.append(match_data)
+
+		results = await asyncio.gather(
+			*(self.reject_reaction(user_id, emoji) for user_id, emoji in rejected),
+			*(self.announce_match(match_data) for match_data in matches),
+			return_exceptions=True
+		)
+		for result in results:
+			if isinstance(result, Exception):
+				utils.log_error(result)
+		await self.cleanup_players()
+
+	async def reject_reaction(self, user_id, emoji):
+		await remove_reaction(
+			self.matchfinding_message,
+			emoji,
+			await utils.get_member(user_id)
+		)
+
+	def get_tick_stats(self):
+		"""
+		:return: A dictionary of the batch size metrics of the matchmaking ticks.
+		"""
+		return {
+			"ticks": self.tick_count,
+			"changes": self.batch_size_total,
+			"average_batch_size": (
+				self.batch_size_total / self.tick_count if self.tick_count != 0 else 0
+			),
+			"max_batch_size": self.max_batch_size
+		}
+
+	def widen_windows(self, now, arrivals, optimal):
+		"""
+		Widens the windows of the players who have waited for another interval.
+		Each of them is taken out of their pools and added back, which matches
+		them right away in greedy mode. In optimal mode, they are added to the
+		arrivals of the tick instead.
+		:return: The matches found in greedy mode.
+		"""
+		interval = get_float("matchmaking_widen_interval", 30)
+		step = get_float("matchmaking_widen_step", 50)
+		limit = get_int("matchmaking_widen_limit", 10)
+		matches = []
+		while len(self.widenings) != 0 and self.widenings[0][0] <= now:
+			_, _, player = heapq.heappop(self.widenings)
+			# Entries of players who left or got matched are skipped here.
+			if self.player_map.get(player.player_id) is not player or player.resolved:
+				continue
+			if player.intervals >= limit:
+				continue
+			for index in player.queued_platforms:
+				self.pools[index].discard(player)
+				if player in arrivals[index]:
+					arrivals[index].remove(player)
+			player.widen(step)
+			heapq.heappush(self.widenings, (
+				now + interval, next(self.widening_sequence), player
+			))
+			for index in player.queued_platforms:
+				if optimal:
+					arrivals[index].append(player)
+					continue
+				partner = self.pools[index].add(player)
+				if partner is not None:
+					self.resolve(partner)
+					self.resolve(player)
+					matches.append(
+						(partner, player, index)
+						if partner.low <= player.low else
+						(player, partner, index)
 					)
-					return
-				player = Player(player_data, self)
-			if platform_data[0] not in player.platforms:
+					break
+		return matches
+
+	def get_wait_stats(self, player_id=None):
+		"""
+		:param player_id: The ID of a player, or None for every player.
+		:return: For every player, the histograms of the wait times until a match,
+		until leaving the queue, and of the current waits of the queued players,
+		as dictionaries. For a player, the seconds they have been waiting, or None
+		if they are not in the queue.
+		"""
+		now = time.monotonic()
+		if player_id is not None:
+			player = self.player_map.get(player_id)
+			return None if player is None or player.resolved else player.get_wait(now)
+		queued = WaitHistogram()
+		for player in self.player_map.values():
+			if not player.resolved:
+				queued.add(player.get_wait(now))
+		return {
+			"matched": self.wait_times.to_dict(),
+			"abandoned": self.abandoned_wait_times.to_dict(),
+			"queued": queued.to_dict()
+		}
+
+	def resolve(self, player):
+		"""
+		Takes a matched player out of every pool right away. Their reactions are
+		removed afterwards by cleanup_players.
+		"""
+		self.wait_times.add(player.get_wait(time.monotonic()))
+		player.resolved = True
+		for pool in self.pools:
+			pool.discard(player)
+		self.done_players.append(player)
+
+	async def cleanup_players(self):
+		done_players, self.done_players = self.done_players, []
+		for player in done_players:
+			if self.player_map.get(player.player_id) is player:
+				self.player_map.pop(player.player_id)
+			member = await utils.get_member(player.player_id)
+			for i in sorted(player.queued_platforms):
 				await remove_reaction(
 					self.matchfinding_message,
-					data.emoji,
-					await utils.get_member(data.user_id)
+					self.platforms[i][3],
+					member
 				)
-				return
-			self.player_map[player.player_id] = player
-			self.pools[platform_data[1]].add(player)
-			player.platform_count += 1
-			await self.find_matches()
-		else:
-			if data.user_id not in self.player_map:
-				return
-			player = self.player_map[data.user_id]
-			pool = self.pools[platform_data[1]]
-			if player in pool:
-				pool.discard(player)
-				player.platform_count -= 1
-				if player.platform_count < 1:
-					self.player_map.pop(player.player_id)
-
-	def mark_player_done(self, player_id):
-		self.done_players.append(player_id)
-
-	def populate_matches(self, matches, pool):
-		ribbon = []
-		for player in self.pools[pool]:
-			ribbon.extend(player.get_nodes())
-		ribbon.sort()
-		current_player = None
-		for node in ribbon:
-			if node.player.resolved:
-				continue
-			if node.start:
-				if current_player is None:
-					current_player = node.player
-				else:
-					current_player.trigger_resolve()
-					node.player.trigger_resolve()
-					matches.append((current_player, node.player, pool))
-					current_player = None
-			else:
-				current_player = None
-		return matches
 
-	async def cleanup_players(self):
-		for player_id in self.done_players:
-			if player_id in self.player_map:
-				player = self.player_map.pop(player_id)
-				member = await utils.get_member(player_id)
-				for i in range(3):
-					pool = self.pools[i]
-					if player in pool:
-						await remove_reaction(
-							self.matchfinding_message,
-							self.platforms[i][3],
-							member
-						)
-						pool.discard(player)
-		self.done_players.clear()
-
-	async def find_matches(self):
-		matches = []
-		for i in range(3):
-			self.populate_matches(matches, i)
-		for match_data in matches:
-			message = await self.announcement_channel.send(
-				f"{match_data[0].get_ping(match_data[2])} vs. "
-				f"{match_data[1].get_ping(match_data[2])} | "
-				f"{utils.platform_names[match_data[2]]} | First to **" +
-				f"{utils.get_match_goal(match_data[0].mu, match_data[1].mu)}"
-				"**"
-			)
-			match = PendingMatch(
-				message_id=message.id,
-				player1=match_data[0].player_id,
-				player2=match_data[1].player_id,
-				time=datetime.now()
+	async def announce_match(self, match_data):
+		player1_data, player2_data = await asyncio.gather(
+			match_message_helper.get_player_by_ID(match_data[0].player_id),
+			match_message_helper.get_player_by_ID(match_data[1].player_id)
+		)
+		if player1_data is None or player2_data is None:
+			# Unregistered since the match was made.
+			logger.info(
+				f"Match of {match_data[0].player_id} and {match_data[1].player_id} "
+				"dropped, a player is no longer registered."
 			)
-			match.save()
-			match_manager.add_match(match)
-			await message.add_reaction(TICK_MARK)
-		await self.cleanup_players()
+			return
+		message = await self.announcement_channel.send(
+			f"{match_data[0].get_ping(match_data[2])} vs. "
+			f"{match_data[1].get_ping(match_data[2])} | "
+			f"{utils.platform_names[match_data[2]]} | First to **" +
+			f"{utils.get_match_goal(match_data[0].mu, match_data[1].mu)}"
+			"**"
+		)
+		# Added right away, so that no reaction to the message is missed.
+		match = PendingMatch(
+			message_id=message.id,
+			player1=match_data[0].player_id,
+			player2=match_data[1].player_id,
+			player1_data=player1_data,
+			player2_data=player2_data,
+			time=datetime.now()
+		)
+		match_manager.add_match(match)
+		try:
+			await match.save()
+		except BaseException:
+			# Without its row the match would be lost on a restart and couldn't be
+			# recorded, so it is taken back.
+			match_manager.remove_match(match)
+			try:
+				await message.delete()
+			except discord.HTTPException as e:
+				utils.log_error(e)
+			raise
+		await message.add_reaction(TICK_MARK)
 
 class PendingMatch:
 	def __init__(self, **args):
 		self.message_id = args["message_id"]
 		self.player1 = args["player1"]
 		self.player2 = args["player2"]
-		self.player1_data = match_message_helper.get_player_by_ID(self.player1)
-		self.player2_data = match_message_helper.get_player_by_ID(self.player2)
+		self.player1_data = args["player1_data"]
+		self.player2_data = args["player2_data"]
 		self.goal = utils.get_match_goal(
 			self.player1_data["rating_mu"], self.player2_data["rating_mu"]
 		)
 		self.time = args["time"]
 		self.timestamp = self.time.timestamp()
-		self.player1_score = None
-		self.player2_score = None
-		self.confirming_timestamp = None
-		self.confirm_status = 0
-		self.cancel_status = 0
-	
-	def save(self):
-		database.execute(
-			"INSERT INTO pending_matches "
-			"(message_id, player1, player2, time) "
-			"VALUES (?, ?, ?, ?)",
+		self.player1_score = args.get("player1_score")
+		self.player2_score = args.get("player2_score")
+		self.confirming_timestamp = args.get("confirming_timestamp")
+		self.confirm_status = args.get("confirm_status", 0)
+		self.cancel_status = args.get("cancel_status", 0)
+		# The players who reacted with the tick mark, followed by MatchManager.
+		self.confirmation_sides = 0
+		self.message = None
+		# Set while the match is being recorded, timed out or cancelled, see
+		# MatchManager.claim.
+		self.resolving = False
+		# The number of failed attempts at expiring the match.
+		self.failures = 0
+
+	@classmethod
+	async def load_all(cls):
+		"""
+		Creates the PendingMatch of every row of pending_matches, with a single
+		query.
+		"""
+		matches = []
+		for row in await database.fetchall(queries.pending_matches):
+			args = {}
+			for key, value in row.dict.items():
+				if key.startswith("player1_") and key != "player1_score":
+					args.setdefault("player1_data", {})[key[8:]] = value
+				elif key.startswith("player2_") and key != "player2_score":
+					args.setdefault("player2_data", {})[key[8:]] = value
+				else:
+					args[key] = value
+			matches.append(cls(**args))
+		return matches
+
+	async def save(self):
+		await database.execute(
+			queries.insert_pending_match,
 			(self.message_id, self.player1, self.player2, self.time)
 		)
-		database.commit()
+		event_log.append(
+			"match_created",
+			message_id=self.message_id,
+			player1=self.player1,
+			player2=self.player2,
+			created=self.time
+		)
+
+	async def save_state(self, event_type):
+		"""
+		Stores the reported scores and the confirm and cancel requests.
+		:param event_type: report, confirm or cancel, for the event log.
+		"""
+		await database.execute(
+			queries.set_pending_match_state,
+			(
+				self.player1_score, self.player2_score,
+				self.confirm_status, self.cancel_status, self.confirming_timestamp,
+				self.message_id
+			)
+		)
+		event_log.append(
+			event_type,
+			message_id=self.message_id,
+			player1_score=self.player1_score,
+			player2_score=self.player2_score,
+			confirm_status=self.confirm_status,
+			cancel_status=self.cancel_status,
+			confirming_timestamp=self.confirming_timestamp
+		)
 
 class MatchManager:	
 	"""
 	Manages arranged matches and result reporting.
 	"""
-	clear_interval = 60
+	# Seconds after which reported scores are recorded without a confirmation.
+	confirm_lifetime = 180
 
 	def __init__(self):
 		self.player_map = {}
 		self.message_map = {}
-		self.pending_matches = []
-		self.confirming_matches = []
+		self.deadlines = DeadlineScheduler(self.expire_matches)
 		self.running = False
 
-	def setup(self):
+	async def setup(self):
 		if self.running: return
 		self.running = True
 		self.bot_id = utils.bot.user.id
@@ -274,16 +512,27 @@ class MatchManager:
 		self.output_channel = utils.bot.get_channel(
 			get_config("command_channel")
 		)
-		for row in (
-			database.execute("SELECT rowid, * FROM pending_matches")
-			.fetchall()
-		):
-			self.add_match(PendingMatch(**row.dict))
-
-		self.match_lifetime = get_config("pending_match_lifetime")
-		asyncio.create_task(self.clear_matches())
 		utils.bot.add_listener(self.on_reaction, "on_raw_reaction_add")
-	
+		utils.bot.add_listener(self.on_reaction, "on_raw_reaction_remove")
+		matches = await PendingMatch.load_all()
+		for match in matches:
+			self.add_match(match)
+		# Reactions made while the bot was offline are only known from the
+		# messages themselves. Afterwards they are followed from the events.
+		semaphore = asyncio.Semaphore(get_int("match_expiry_concurrency", 8))
+		async def fetch(match):
+			async with semaphore:
+				try:
+					match.confirmation_sides |= await self.fetch_confirmation_sides(match)
+				except discord.HTTPException as e:
+					# The message may have been deleted, the match then expires
+					# without confirmations.
+					utils.log_error(e)
+		try:
+			await asyncio.gather(*(fetch(match) for match in matches))
+		finally:
+			self.deadlines.setup()
+
 	async def on_reaction(self, data):
 		if data.user_id == self.bot_id:
 			return
@@ -292,37 +541,179 @@ class MatchManager:
 		if data.message_id not in self.message_map:
 			return
 		match = self.message_map[data.message_id]
-		if data.user_id != match.player1 and data.user_id != match.player2:
-			await remove_reaction(
-				await self.announcement_channel.fetch_message(data.message_id),
-				data.emoji,
-				await utils.get_member(data.user_id)
-			)
-	
+		side = 2 if data.user_id == match.player1 else 1 if data.user_id == match.player2 else 0
+		if side == 0:
+			if data.event_type == "REACTION_ADD":
+				await remove_reaction(
+					match.message,
+					data.emoji,
+					await utils.get_member(data.user_id)
+				)
+		elif data.emoji.id is None and data.emoji.name == TICK_MARK:
+			if data.event_type == "REACTION_ADD":
+				match.confirmation_sides |= side
+			else:
+				match.confirmation_sides &= ~side
+
 	def add_match(self, match):
-		self.pending_matches.append(match)
 		self.player_map[match.player1] = (match, False)
 		self.player_map[match.player2] = (match, True)
 		self.message_map[match.message_id] = match
-	
-	async def cleanup_for_match(self, match):
-		database.execute(
-			"DELETE FROM pending_matches WHERE message_id = ?",
-			(match.message_id,)
+		# A handle to the message that doesn't need fetching it.
+		match.message = self.announcement_channel.get_partial_message(match.message_id)
+		self.schedule_match(match)
+
+	def remove_match(self, match):
+		self.deadlines.cancel(match)
+		self.message_map.pop(match.message_id, None)
+		self.player_map.pop(match.player1, None)
+		self.player_map.pop(match.player2, None)
+
+	def schedule_match(self, match):
+		"""
+		Sets the deadline of a match, after which it times out, or gets recorded
+		if scores were reported. To be called again when scores are reported.
+		A change of pending_match_lifetime applies to the matches scheduled
+		afterwards.
+		"""
+		if match.confirming_timestamp is None:
+			self.deadlines.schedule(
+				match, match.timestamp + get_float("pending_match_lifetime")
+			)
+		else:
+			self.deadlines.schedule(match, match.confirming_timestamp + self.confirm_lifetime)
+
+	async def expire_matches(self, matches):
+		"""
+		Processes the matches whose deadline passed: pending ones time out, the
+		ones with reported scores get recorded. Discord calls are made
+		concurrently, at most match_expiry_concurrency at once, and all the
+		database changes are made in a single transaction.
+		"""
+		semaphore = asyncio.Semaphore(get_int("match_expiry_concurrency", 8))
+		async def limited(coroutine):
+			async with semaphore:
+				return await coroutine
+
+		# Matches being recorded or cancelled by a command are left to it.
+		matches = [match for match in matches if self.claim(match)]
+		timeouts = []
+		timeout_sides = []
+		timeout_ratings = []
+		completions = []
+		match_ratings = []
+		for match in matches:
+			try:
+				if match.confirming_timestamp is None:
+					sides = match.confirmation_sides
+					timeout_ratings.append(self.rate_timeout(match, sides))
+					timeout_sides.append(sides)
+					timeouts.append(match)
+				else:
+					match_ratings.append(self.rate_match(match))
+					completions.append(match)
+			except Exception as e:
+				utils.log_error(e)
+				self.retry_match(match)
+
+		def record(connection):
+			for match, ratings in zip(timeouts, timeout_ratings):
+				self.record_timeout(connection, match, ratings)
+			return [
+				self.record_match(connection, match, ratings)
+				for match, ratings in zip(completions, match_ratings)
+			]
+		try:
+			rows = await database.write(record)
+		except Exception as e:
+			utils.log_error(e)
+			for match in timeouts + completions:
+				self.retry_match(match)
+			return
+		for match, ratings in zip(timeouts, timeout_ratings):
+			self.log_timeout(match, ratings)
+			self.index_timeout(ratings)
+		for match, ratings, row in zip(completions, match_ratings, rows):
+			event_log.append("match_recorded", message_id=match.message_id, match=row)
+			self.index_match(match, ratings)
+		role_sync.notify()
+		if len(matches) > 1:
+			logger.info(f"Expired {len(timeouts)} pending matches and recorded {len(completions)} matches.")
+
+		results = await asyncio.gather(
+			*(
+				limited(self.announce_match_timeout(match, sides, ratings))
+				for match, sides, ratings in zip(timeouts, timeout_sides, timeout_ratings)
+			),
+			*(
+				limited(self.announce_match_complete(match, ratings, row["id"]))
+				for match, ratings, row in zip(completions, match_ratings, rows)
+			),
+			return_exceptions=True
 		)
-		database.commit()
-		self.message_map.pop(match.message_id)
-		self.player_map.pop(match.player1)
-		self.player_map.pop(match.player2)
-		await (
-			await self.announcement_channel.fetch_message(match.message_id)
-		).clear_reactions()
-
-	async def get_confirmation_sides(self, message_id, player1, player2):
+		for result in results:
+			if isinstance(result, Exception):
+				utils.log_error(result)
+		# The database changes are done, so a match whose announcement failed
+		# before releasing it must not stay pending.
+		for match in timeouts + completions:
+			if self.message_map.get(match.message_id) is match:
+				try:
+					await self.release_match(match)
+				except Exception as e:
+					utils.log_error(e)
+
+	def claim(self, match):
+		"""
+		Marks a match as being resolved, so that it isn't recorded, timed out or
+		cancelled twice by concurrent tasks.
+		:return: False if the match is already resolved or being resolved.
+		"""
+		if match.resolving or self.message_map.get(match.message_id) is not match:
+			return False
+		match.resolving = True
+		return True
+
+	def retry_match(self, match):
+		"""
+		Schedules a match whose expiry failed again, with an exponential backoff.
+		"""
+		match.resolving = False
+		match.failures += 1
+		self.deadlines.schedule(match, time.time() + min(300, 5 * 2**match.failures))
+
+	def delete_pending_match(self, connection, match):
+		database.run_statement(connection, queries.delete_pending_match, (match.message_id,))
+
+	async def cleanup_for_match(self, match):
+		"""
+		Cancels a match.
+		:return: False if the match was already being resolved.
+		"""
+		if not self.claim(match):
+			return False
+		try:
+			await database.write(self.delete_pending_match, match)
+		except BaseException:
+			match.resolving = False
+			raise
+		event_log.append("match_cancelled", message_id=match.message_id)
+		await self.release_match(match)
+		return True
+
+	async def release_match(self, match):
+		self.remove_match(match)
+		await match.message.clear_reactions()
+
+	async def fetch_confirmation_sides(self, match):
+		"""
+		Looks up the tick mark reactions of a match message through the API.
+		:return: The sides that reacted, 2 for player 1 and 1 for player 2.
+		"""
 		result = 0
 		reaction = None
 		for message_reaction in (
-			(await self.announcement_channel.fetch_message(message_id))
+			(await self.announcement_channel.fetch_message(match.message_id))
 			.reactions
 		):
 			if message_reaction.emoji == TICK_MARK:
@@ -330,11 +721,15 @@ class MatchManager:
 				break
 		if reaction is not None:
 			async for user in reaction.users():
-				if user.id == player1: result |= 2
-				elif user.id == player2: result |= 1
+				if user.id == match.player1: result |= 2
+				elif user.id == match.player2: result |= 1
 		return result
-	
-	async def process_match_complete(self, match):
+
+	def rate_match(self, match):
+		"""
+		:return: The old and new ratings of both players after the reported
+		scores, as (old_rating1, new_rating1, old_rating2, new_rating2).
+		"""
 		player1 = match.player1_data
 		old_rating1 = glicko2.Rating(
 			player1["rating_mu"], player1["rating_phi"], player1["rating_sigma"]
@@ -346,36 +741,57 @@ class MatchManager:
 
 		if match.player1_score > match.player2_score:
 			new_rating1, new_rating2 = (
-				glicko2.Glicko2().rate_1vs1(old_rating1, old_rating2)
+				glicko2_env.rate_1vs1(old_rating1, old_rating2)
 			)
 		else:
 			new_rating2, new_rating1 = (
-				glicko2.Glicko2().rate_1vs1(old_rating2, old_rating1)
+				glicko2_env.rate_1vs1(old_rating2, old_rating1)
 			)
+		return old_rating1, new_rating1, old_rating2, new_rating2
 
-		cursor = database.execute("""
-			INSERT INTO matches (
-				player1, player2, player1_score, player2_score,
-				player1_old_mu, player1_old_phi, player1_old_sigma,
-				player1_new_mu, player1_new_phi, player1_new_sigma,
-				player2_old_mu, player2_old_phi, player2_old_sigma,
-				player2_new_mu, player2_new_phi, player2_new_sigma
-			) VALUES (
-				?, ?, ?, ?,
-				?, ?, ?,
-				?, ?, ?,
-				?, ?, ?,
-				?, ?, ?
-			)
-		""", (
-			player1["id"], player2["id"],
-			match.player1_score, match.player2_score,
-			old_rating1.mu, old_rating1.phi, old_rating1.sigma,
-			new_rating1.mu, new_rating1.phi, new_rating1.sigma,
-			old_rating2.mu, old_rating2.phi, old_rating2.sigma,
-			new_rating2.mu, new_rating2.phi, new_rating2.sigma
-		))
-		database.commit()
+	def record_match(self, connection, match, ratings):
+		"""
+		Inserts a match with the ratings from rate_match, queues the rank role
+		changes and deletes the pending match. The Report trigger updates the
+		players.
+		:return: The inserted row as a dictionary, with its ID.
+		"""
+		old_rating1, new_rating1, old_rating2, new_rating2 = ratings
+		row = {
+			"date": datetime.utcnow().replace(microsecond=0),
+			"player1": match.player1,
+			"player2": match.player2,
+			"player1_score": match.player1_score,
+			"player2_score": match.player2_score
+		}
+		for player, old_rating, new_rating in (
+			("player1", old_rating1, new_rating1),
+			("player2", old_rating2, new_rating2)
+		):
+			for column in ("mu", "phi", "sigma"):
+				row[f"{player}_old_{column}"] = getattr(old_rating, column)
+				row[f"{player}_new_{column}"] = getattr(new_rating, column)
+		row["id"] = database.run_statement(connection, queries.insert_match, row).lastrowid
+		queue_transitions(connection, compute_transitions((
+			(match.player1, old_rating1.mu, old_rating1.phi, new_rating1.mu, new_rating1.phi),
+			(match.player2, old_rating2.mu, old_rating2.phi, new_rating2.mu, new_rating2.phi)
+		)))
+		self.delete_pending_match(connection, match)
+		return row
+
+	def index_match(self, match, ratings):
+		"""
+		Updates the rank index with the ratings from rate_match. Done right after
+		the database write rather than in the announcement, which can fail.
+		"""
+		_, new_rating1, _, new_rating2 = ratings
+		rank_index.update(match.player1, new_rating1.mu, new_rating1.phi)
+		rank_index.update(match.player2, new_rating2.mu, new_rating2.phi)
+
+	async def announce_match_complete(self, match, ratings, match_id):
+		old_rating1, new_rating1, old_rating2, new_rating2 = ratings
+		player1 = match.player1_data
+		player2 = match.player2_data
 
 		embed = discord.Embed(
 			type="rich",
@@ -392,39 +808,87 @@ class MatchManager:
 			old_rating2.mu, old_rating2.phi,
 			new_rating2.mu, new_rating2.phi
 		)
-		embed.set_footer(text=f"Match ID: {cursor.lastrowid}")
-		await self.output_channel.send(embed=embed)
-
-		await utils.update_role(
-			match.player1,
-			old_rating1.mu, old_rating1.phi,
-			new_rating1.mu, new_rating1.phi
+		embed.set_footer(text=f"Match ID: {match_id}")
+		await asyncio.gather(
+			self.output_channel.send(embed=embed),
+			self.release_match(match)
 		)
-		await utils.update_role(
-			match.player2,
-			old_rating2.mu, old_rating2.phi,
-			new_rating2.mu, new_rating2.phi
-		)
-
-		await self.cleanup_for_match(match)
 
-	async def process_player(self, player, flag, embed):
-		old_rating = glicko2.Rating(
-			player["rating_mu"], player["rating_phi"], player["rating_sigma"]
-		)
-		new_rating = old_rating if flag != 0 else \
-			glicko2.Glicko2().rate_1vs1(old_rating, old_rating)[1]
-		database.execute(
-			"UPDATE players "
-			"SET rating_mu = ?, rating_phi = ?, rating_sigma = ? "
-			"WHERE id = ?",
-			(new_rating.mu, new_rating.phi, new_rating.sigma, player["id"])
+	async def process_match_complete(self, match):
+		"""
+		Records a match confirmed by both players.
+		:return: False if the match was already being resolved.
+		"""
+		if not self.claim(match):
+			return False
+		try:
+			ratings = self.rate_match(match)
+			row = await database.write(self.record_match, match, ratings)
+		except BaseException:
+			match.resolving = False
+			raise
+		event_log.append("match_recorded", message_id=match.message_id, match=row)
+		self.index_match(match, ratings)
+		role_sync.notify()
+		try:
+			await self.announce_match_complete(match, ratings, row["id"])
+		finally:
+			if self.message_map.get(match.message_id) is match:
+				await self.release_match(match)
+		return True
+
+	def rate_timeout(self, match, sides):
+		"""
+		A player who didn't confirm the match is rated as losing against
+		themselves, the other one keeps their rating.
+		:param sides: The confirmation_sides of the match.
+		:return: A list of (player data, old rating, new rating) for both players.
+		"""
+		if sides == 0:
+			sides = 3
+		ratings = []
+		for player, flag in (
+			(match.player1_data, sides & 2),
+			(match.player2_data, sides & 1)
+		):
+			old_rating = glicko2.Rating(
+				player["rating_mu"], player["rating_phi"], player["rating_sigma"]
+			)
+			new_rating = old_rating if flag != 0 else \
+				glicko2_env.rate_1vs1(old_rating, old_rating)[1]
+			ratings.append((player, old_rating, new_rating))
+		return ratings
+
+	def record_timeout(self, connection, match, ratings):
+		database.run_statements(
+			connection,
+			queries.set_rating,
+			[
+				(new_rating.mu, new_rating.phi, new_rating.sigma, player["id"])
+				for player, _, new_rating in ratings
+			]
 		)
-		database.commit()
-		await match_message_helper.add_report_field(
-			embed, player, None,
-			old_rating.mu, old_rating.phi,
-			new_rating.mu, new_rating.phi
+		queue_transitions(connection, compute_transitions(
+			(player["id"], old_rating.mu, old_rating.phi, new_rating.mu, new_rating.phi)
+			for player, old_rating, new_rating in ratings
+		))
+		self.delete_pending_match(connection, match)
+
+	def index_timeout(self, ratings):
+		"""
+		The same as index_match, with the ratings from rate_timeout.
+		"""
+		for player, _, new_rating in ratings:
+			rank_index.update(player["id"], new_rating.mu, new_rating.phi)
+
+	def log_timeout(self, match, ratings):
+		event_log.append(
+			"timeout",
+			message_id=match.message_id,
+			ratings=[
+				[player["id"], new_rating.mu, new_rating.phi, new_rating.sigma]
+				for player, _, new_rating in ratings
+			]
 		)
 	
 	match_timeout_messages = [
@@ -438,49 +902,28 @@ class MatchManager:
 		"confirmed to play the match but did not actually play."
 	]
 
-	async def process_match_timeout(self, match):
-		sides = await self.get_confirmation_sides(
-			match.message_id, match.player1, match.player2
-		)
+	async def announce_match_timeout(self, match, sides, ratings):
 		embed = discord.Embed(
 			type="rich",
 			title="Match timeout",
 			color=0xFF0000
 		)
-		if sides == 0:
-			sides = 3
-		await self.process_player(match.player1_data, sides & 2, embed)
-		await self.process_player(match.player2_data, sides & 1, embed)
-		await self.output_channel.send(
-			content=self.match_timeout_messages[sides] % {
-				"player1": match.player1,
-				"player2": match.player2
-			},
-			embed=embed
+		for player, old_rating, new_rating in ratings:
+			await match_message_helper.add_report_field(
+				embed, player, None,
+				old_rating.mu, old_rating.phi,
+				new_rating.mu, new_rating.phi
+			)
+		await asyncio.gather(
+			self.output_channel.send(
+				content=self.match_timeout_messages[3 if sides == 0 else sides] % {
+					"player1": match.player1,
+					"player2": match.player2
+				},
+				embed=embed
+			),
+			self.release_match(match)
 		)
-		await self.cleanup_for_match(match)
-
-	async def clear_matches(self):
-		while True:
-			try:
-				time = datetime.now().timestamp()
-				while len(self.pending_matches) != 0:
-					match = self.pending_matches[0]
-					if time - match.timestamp >= self.match_lifetime:
-						await self.process_match_timeout(match)
-						self.pending_matches.pop(0)
-					else:
-						break
-				while len(self.confirming_matches) != 0:
-					match = self.confirming_matches[0]
-					if time - match.confirming_timestamp >= 180:
-						await self.process_match_complete(match)
-						self.confirming_matches.pop(0)
-					else:
-						break
-				await asyncio.sleep(self.clear_interval)
-			except Exception as e:
-				utils.log_error(e)
 
 async def remove_reaction(message, emoji, user):
 	"""
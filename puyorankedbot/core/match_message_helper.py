@@ -2,7 +2,8 @@
 # messages used by cogs.matches and core.match_manager
 
 from core import utils
-from core.database import database
+from core import database
+from core import queries
 
 async def get_player_name(player):
 	if player["display_name"] is None:
@@ -24,9 +25,5 @@ async def add_report_field(embed, player, score, old_mu, old_phi, new_mu, new_ph
 		)
 	)
 
-def get_player_by_ID(id_in):
-	return database.execute(
-		"SELECT id, display_name, rating_mu, rating_phi, rating_sigma "
-		"FROM players WHERE id=? AND platforms<>''",
-		(id_in,)
-	).fetchone()
+async def get_player_by_ID(id_in):
+	return await database.fetchone(queries.player_ratings, (id_in,))
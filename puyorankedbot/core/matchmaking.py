@@ -0,0 +1,277 @@
+# This module contains the matchmaking pools. Each queued player has a rating
+# window (mu - 2*phi, mu + 2*phi), and two players can be matched if their
+# windows overlap.
+
+import time
+from bisect import bisect_left
+from itertools import count
+from core.sorted_list import SortedList
+
+# Weights of the pairing cost used by find_optimal_matches, in rating points.
+wait_discount = 2 # Per second waited by each of the two players.
+platform_penalty = 100 # Per player, if the pool isn't the first one they joined.
+
+class Pool:
+	"""
+	The queued players of one platform, sorted by the lower bound of their
+	window. Every overlapping pair is matched as soon as it appears, so the
+	windows left in the pool never overlap each other. A new window therefore
+	only has to be compared with its two neighbors.
+	This gives the same pairs as sweeping over all window bounds sorted on a
+	ribbon, without rebuilding anything on each join.
+	"""
+	sequence = count()
+
+	def __init__(self, index):
+		"""
+		:param index: The index of the platform of the pool.
+		"""
+		self.index = index
+		self.order = SortedList()
+		self.keys = {}
+
+	def add(self, player):
+		"""
+		Adds a player to the pool, unless their window overlaps a queued one.
+		:param player: An object with low and high attributes.
+		:return: The queued player overlapping the window, who is then removed
+		from the pool, or None if the player was added.
+		"""
+		key = (player.low, player.high, next(self.sequence), player)
+		i = self.order.bisect_left(key)
+		# A window starting earlier is matched first, like on the ribbon.
+		if i > 0:
+			previous = self.order[i - 1]
+			if previous[1] >= player.low:
+				self.discard(previous[3])
+				return previous[3]
+		if i < len(self.order):
+			following = self.order[i]
+			if following[0] <= player.high:
+				self.discard(following[3])
+				return following[3]
+		self.keys[player] = key
+		self.order.add(key)
+		return None
+
+	def insert(self, player):
+		"""
+		Adds a player to the pool without looking for an overlapping window. The
+		caller has to make sure there is none.
+		"""
+		key = (player.low, player.high, next(self.sequence), player)
+		self.keys[player] = key
+		self.order.add(key)
+
+	def overlapping(self, low, high):
+		"""
+		:return: The queued players whose window overlaps (low, high). Since the
+		windows in the pool don't overlap, they are sorted by both bounds and
+		these players are contiguous.
+		"""
+		i = self.order.bisect_left((low,))
+		if i > 0 and self.order[i - 1][1] >= low:
+			i -= 1
+		j = self.order.bisect_right((high, float("inf")))
+		return [key[3] for key in self.order.islice(i, j)]
+
+	def discard(self, player):
+		key = self.keys.pop(player, None)
+		if key is not None:
+			self.order.remove(key)
+
+	def __contains__(self, player):
+		return player in self.keys
+
+	def __iter__(self):
+		return (key[3] for key in self.order)
+
+	def __len__(self):
+		return len(self.order)
+
+class WaitHistogram:
+	"""
+	Counts queue wait times in buckets, to tune the matchmaking settings.
+	"""
+	bounds = (5, 10, 30, 60, 120, 300, 600, 1800)
+
+	def __init__(self):
+		self.counts = [0] * (len(self.bounds) + 1)
+		self.total = 0
+
+	def add(self, wait):
+		"""
+		:param wait: A wait time, in seconds.
+		"""
+		self.counts[bisect_left(self.bounds, wait)] += 1
+		self.total += wait
+
+	def to_dict(self):
+		"""
+		:return: The number of waits per bucket, keyed by the upper bound of the
+		bucket in seconds, along with the number of waits and their mean.
+		"""
+		count = sum(self.counts)
+		return {
+			"buckets": dict(zip(self.bounds + (float("inf"),), self.counts)),
+			"count": count,
+			"mean": self.total / count if count != 0 else 0
+		}
+
+def pairing_cost(player1, player2, index, now):
+	"""
+	The cost of matching two players in a pool, lower is better: their rating
+	gap, minus a discount for the time they have waited, plus a penalty when
+	the pool isn't the platform they queued for first.
+	:param index: The index of the pool.
+	:param now: The current time, in seconds.
+	"""
+	cost = abs(player1.mu - player2.mu)
+	for player in (player1, player2):
+		joined = player.queued_platforms
+		cost -= wait_discount * (now - min(joined.values()))
+		if index != min(joined, key=joined.get):
+			cost += platform_penalty
+	return cost
+
+class PairingGraph:
+	"""
+	The players who can be matched together, with the cheapest pool for each
+	pair, and a matching of them.
+	"""
+	def __init__(self):
+		self.neighbors = {}
+		self.mates = {}
+
+	def add_edge(self, player1, player2, index, now):
+		cost = pairing_cost(player1, player2, index, now)
+		edge = self.neighbors.setdefault(player1, {}).get(player2)
+		if edge is None or cost < edge[0]:
+			self.neighbors[player1][player2] = (cost, index)
+			self.neighbors.setdefault(player2, {})[player1] = (cost, index)
+
+	def cost(self, player1, player2):
+		return self.neighbors[player1][player2][0]
+
+	def match(self, player1, player2):
+		self.mates[player1] = player2
+		self.mates[player2] = player1
+
+	def match_greedily(self):
+		edges = sorted(
+			(
+				(edge[0], player1, player2)
+				for player1, neighbors in self.neighbors.items()
+				for player2, edge in neighbors.items()
+				if id(player1) < id(player2)
+			),
+			key=lambda edge: edge[0]
+		)
+		for _, player1, player2 in edges:
+			if player1 not in self.mates and player2 not in self.mates:
+				self.match(player1, player2)
+
+	def augment(self, deadline):
+		"""
+		Matches an unmatched player u by rematching the partner w of one of their
+		neighbors v to an unmatched neighbor x, along the path u-v-w-x. After the
+		greedy pass, unmatched players have no unmatched neighbors, so these are
+		the shortest paths that add a pair.
+		:return: True if the matching got larger.
+		"""
+		improved = False
+		for u in self.neighbors:
+			if time.perf_counter() > deadline:
+				break
+			if u in self.mates:
+				continue
+			for v in self.neighbors[u]:
+				w = self.mates[v]
+				x = min(
+					(x for x in self.neighbors[w] if x not in self.mates and x is not u),
+					key=lambda x: self.cost(w, x),
+					default=None
+				)
+				if x is not None:
+					self.match(u, v)
+					self.match(w, x)
+					improved = True
+					break
+		return improved
+
+	def swap(self, deadline):
+		"""
+		Replaces two pairs (a, b) and (c, d) with (a, c) and (b, d) when it is
+		cheaper.
+		:return: True if the cost of the matching went down.
+		"""
+		improved = False
+		for a in list(self.mates):
+			if time.perf_counter() > deadline:
+				break
+			b = self.mates[a]
+			for c in self.neighbors[a]:
+				d = self.mates.get(c)
+				if d is None or c is b or d is a or d not in self.neighbors[b]:
+					continue
+				if (
+					self.cost(a, c) + self.cost(b, d) <
+					self.cost(a, b) + self.cost(c, d) - 1e-9
+				):
+					self.match(a, c)
+					self.match(b, d)
+					improved = True
+					break
+		return improved
+
+def find_optimal_matches(pools, arrivals, now, time_budget):
+	"""
+	Matches the players who joined the pools during a tick, considering all the
+	pools at once. The matching is first built greedily by pairing cost, then
+	improved by augment and swap until nothing changes or the time budget runs
+	out. This approximates a minimum cost maximum matching.
+	Every overlapping pair involves a new player, since the windows queued in a
+	pool never overlap, and the matching is always maximal, so that still holds
+	afterwards.
+	:param pools: The list of Pools.
+	:param arrivals: For each pool, a list of the players joining it. Their
+	queued_platforms must map pool indices to the time they were joined.
+	:param now: The current time, in seconds.
+	:param time_budget: The time given to the improvements, in seconds.
+	:return: A list of (player1, player2, pool index), with the player with the
+	lower window first. The matched players are removed from every pool and
+	the others are added to the pools they joined.
+	"""
+	deadline = time.perf_counter() + time_budget
+	graph = PairingGraph()
+	for index, players in enumerate(arrivals):
+		pool = pools[index]
+		players = sorted(players, key=lambda player: player.low)
+		for i, player in enumerate(players):
+			graph.neighbors.setdefault(player, {})
+			for queued in pool.overlapping(player.low, player.high):
+				graph.add_edge(player, queued, index, now)
+			for other in players[i + 1:]:
+				if other.low > player.high:
+					break
+				graph.add_edge(player, other, index, now)
+
+	graph.match_greedily()
+	improving = True
+	while improving and time.perf_counter() < deadline:
+		improving = graph.augment(deadline)
+		improving = graph.swap(deadline) or improving
+
+	matches = []
+	for player1, player2 in graph.mates.items():
+		if player1.low > player2.low or (player1.low == player2.low and id(player1) > id(player2)):
+			continue
+		matches.append((player1, player2, graph.neighbors[player1][player2][1]))
+		for pool in pools:
+			pool.discard(player1)
+			pool.discard(player2)
+	for index, players in enumerate(arrivals):
+		for player in players:
+			if player not in graph.mates:
+				pools[index].insert(player)
+	return matches
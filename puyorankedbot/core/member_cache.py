@@ -0,0 +1,117 @@
+# This module resolves guild members by ID while keeping the number of REST
+# requests low. Members are remembered for a while, refreshed from gateway
+# events when possible, and concurrent lookups of the same ID share a single
+# fetch_member call.
+
+import asyncio
+import time
+from collections import OrderedDict
+import discord
+
+class MemberCache:
+	"""
+	A TTL and LRU bounded cache of discord.Member objects. Members that are not
+	in the guild are cached as None, for a shorter time since they may join.
+	"""
+	def __init__(self, capacity=4096, ttl=900, negative_ttl=60):
+		"""
+		:param capacity: The maximum number of cached members.
+		:param ttl: Seconds after which a cached member is fetched again.
+		:param negative_ttl: The same for a member who is not in the guild.
+		"""
+		self.capacity = capacity
+		self.ttl = ttl
+		self.negative_ttl = negative_ttl
+		self.entries = OrderedDict()
+		self.pending = {}
+		self.guild = None
+		self.hits = 0
+		self.misses = 0
+		self.fetches = 0
+		self.running = False
+
+	def setup(self, bot, guild):
+		self.guild = guild
+		if self.running: return
+		self.running = True
+		# Member events are only delivered with the members intent, the
+		# reaction payload carries the member with the default intents.
+		bot.add_listener(self.on_member_update, "on_member_update")
+		bot.add_listener(self.on_member_join, "on_member_join")
+		bot.add_listener(self.on_member_remove, "on_member_remove")
+		bot.add_listener(self.on_raw_reaction_add, "on_raw_reaction_add")
+
+	def put(self, member_id, member):
+		self.entries[member_id] = (
+			member,
+			time.monotonic() + (self.ttl if member is not None else self.negative_ttl)
+		)
+		self.entries.move_to_end(member_id)
+		while len(self.entries) > self.capacity:
+			self.entries.popitem(last=False)
+
+	async def get(self, member_id):
+		"""
+		:return: The member with the ID, or None if they are not in the guild.
+		"""
+		entry = self.entries.get(member_id)
+		if entry is not None and entry[1] > time.monotonic():
+			self.entries.move_to_end(member_id)
+			self.hits += 1
+			return entry[0]
+		self.misses += 1
+		future = self.pending.get(member_id)
+		if future is None:
+			future = asyncio.ensure_future(self.fetch(member_id))
+			self.pending[member_id] = future
+		# Shielded so that a cancelled caller doesn't cancel the fetch others wait on.
+		return await asyncio.shield(future)
+
+	async def fetch(self, member_id):
+		try:
+			self.fetches += 1
+			try:
+				member = await self.guild.fetch_member(member_id)
+			except discord.NotFound:
+				member = None
+			# Unless the member joined meanwhile, see on_member_join.
+			if self.pending.get(member_id) is asyncio.current_task():
+				self.put(member_id, member)
+			return member
+		finally:
+			if self.pending.get(member_id) is asyncio.current_task():
+				del self.pending[member_id]
+
+	def stats(self):
+		"""
+		:return: A dictionary of the cache counters.
+		"""
+		lookups = self.hits + self.misses
+		return {
+			"size": len(self.entries),
+			"hits": self.hits,
+			"misses": self.misses,
+			"fetches": self.fetches,
+			"hit_rate": self.hits / lookups if lookups != 0 else 0
+		}
+
+	async def on_member_update(self, before, after):
+		if after.guild.id == self.guild.id:
+			self.put(after.id, after)
+
+	async def on_member_join(self, member):
+		if member.guild.id == self.guild.id:
+			# A fetch still running may have started before the join, its result
+			# must not replace this one.
+			self.pending.pop(member.id, None)
+			self.put(member.id, member)
+
+	async def on_member_remove(self, member):
+		if member.guild.id == self.guild.id:
+			self.put(member.id, None)
+
+	async def on_raw_reaction_add(self, data):
+		if data.member is not None and data.guild_id == self.guild.id:
+			self.put(data.member.id, data.member)
+
+member_cache = MemberCache()
@@ -0,0 +1,131 @@
+# This module declares the statements run through the database helpers, each
+# once. Statements that depend on a platform are in dictionaries by platform
+# instead of being built when run, so that every statement has a fixed text,
+# which the statement cache of the connections can reuse, and a name under
+# which database.get_query_stats reports its timings.
+
+from core.utils import platform_name_mapping, placement_phi
+
+class Query:
+	"""
+	A statement. The name is set from the name of the variable at the end of
+	this module.
+	"""
+	def __init__(self, sql):
+		self.sql = sql
+		self.name = None
+
+	def __repr__(self):
+		return f"Query({self.name})"
+
+def by_platform(sql):
+	"""
+	:param sql: A statement with {platform} in place of the platform.
+	:return: A dictionary of the statement of each platform.
+	"""
+	return {platform: Query(sql.format(platform=platform)) for platform in platform_name_mapping}
+
+# Players.
+
+player = Query("SELECT * FROM players WHERE id = ? AND platforms <> ''")
+player_by_display_name = Query("SELECT * FROM players WHERE display_name = ? AND platforms <> ''")
+player_by_username = by_platform("SELECT * FROM players WHERE username_{platform} = ?")
+# The columns needed by match announcements and PendingMatch.
+player_ratings = Query(
+	"SELECT id, display_name, rating_mu, rating_phi, rating_sigma "
+	"FROM players WHERE id = ? AND platforms <> ''"
+)
+# The IDs are given as a JSON array, so that the number of players doesn't
+# change the statement.
+players_by_ids = Query(
+	"SELECT * FROM players WHERE platforms <> '' AND "
+	"id IN (SELECT value FROM json_each(?))"
+)
+player_display_name = Query("SELECT display_name FROM players WHERE id = ?")
+player_platforms = Query("SELECT platforms FROM players WHERE id = ? AND platforms <> ''")
+# Including unregistered players, who keep their rating.
+player_registration = Query("SELECT platforms, rating_mu, rating_phi FROM players WHERE id = ?")
+player_registered = Query("SELECT EXISTS (SELECT 1 FROM players WHERE id = ? AND platforms <> '')")
+display_name_taken = Query("SELECT EXISTS (SELECT 1 FROM players WHERE display_name = ?)")
+username_taken = by_platform("SELECT EXISTS (SELECT 1 FROM players WHERE username_{platform} = ?)")
+player_stats = Query("SELECT matches, wins FROM player_stats WHERE id = ?")
+
+# A range scan of the players_phi index, whatever placement_phi is.
+ranked_players = Query(
+	"SELECT id, display_name, rating_mu, rating_phi, platforms "
+	f"FROM players WHERE platforms <> '' AND rating_phi < {placement_phi}"
+)
+ranked_ratings = Query(
+	"SELECT id, rating_mu, rating_phi FROM players "
+	f"WHERE platforms <> '' AND rating_phi < {placement_phi}"
+)
+
+insert_player = Query("INSERT INTO players (id, platforms) VALUES (?, ?)")
+set_platforms = Query("UPDATE players SET platforms = ? WHERE id = ?")
+set_display_name = Query("UPDATE players SET display_name = ? WHERE id = ?")
+set_rating = Query(
+	"UPDATE players SET rating_mu = ?, rating_phi = ?, rating_sigma = ? WHERE id = ?"
+)
+set_username = by_platform("UPDATE players SET username_{platform} = ? WHERE id = ?")
+# Unregistering from all platforms.
+clear_player = Query(
+	"UPDATE players SET "
+	"platforms = '', display_name = NULL, "
+	"username_pc = NULL, username_switch = NULL, username_ps4 = NULL "
+	"WHERE id = ?"
+)
+
+# Matches.
+
+match = Query("SELECT * FROM matches WHERE id = ?")
+# The Report trigger updates the players and player_stats.
+match_columns = (
+	"date", "player1", "player2", "player1_score", "player2_score",
+	"player1_old_mu", "player1_old_phi", "player1_old_sigma",
+	"player1_new_mu", "player1_new_phi", "player1_new_sigma",
+	"player2_old_mu", "player2_old_phi", "player2_old_sigma",
+	"player2_new_mu", "player2_new_phi", "player2_new_sigma"
+)
+insert_match = Query(
+	f"INSERT INTO matches ({', '.join(match_columns)}) "
+	f"VALUES ({', '.join(':' + column for column in match_columns)})"
+)
+# The pending matches with the columns of both players needed by PendingMatch.
+pending_matches = Query(
+	"SELECT pending_matches.*, " +
+	", ".join(
+		f"{player}.{column} AS {player}_{column}"
+		for player in ("player1", "player2")
+		for column in ("id", "display_name", "rating_mu", "rating_phi", "rating_sigma")
+	) +
+	" FROM pending_matches "
+	"JOIN players AS player1 ON player1.id = pending_matches.player1 "
+	"JOIN players AS player2 ON player2.id = pending_matches.player2"
+)
+insert_pending_match = Query(
+	"INSERT INTO pending_matches "
+	"(message_id, player1, player2, time) "
+	"VALUES (?, ?, ?, ?)"
+)
+delete_pending_match = Query("DELETE FROM pending_matches WHERE message_id = ?")
+set_pending_match_state = Query(
+	"UPDATE pending_matches SET "
+	"player1_score = ?, player2_score = ?, "
+	"confirm_status = ?, cancel_status = ?, confirming_timestamp = ? "
+	"WHERE message_id = ?"
+)
+
+# Roles.
+
+role_sync_queue = Query("SELECT member_id, old_rank, new_rank FROM role_sync_queue ORDER BY queued")
+
+def name_queries():
+	for name, value in globals().items():
+		if isinstance(value, Query):
+			value.name = name
+		elif isinstance(value, dict):
+			for key, query in value.items():
+				if isinstance(query, Query):
+					query.name = f"{name}[{key}]"
+
+name_queries()
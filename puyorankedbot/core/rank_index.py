@@ -0,0 +1,110 @@
+# This module keeps the ranked players in leaderboard order in memory, so that
+# leaderboard positions and pages don't need to scan the players table.
+
+from core import database
+from core import queries
+from core import utils
+from core.sorted_list import SortedList
+
+class RankIndex:
+	"""
+	An order-statistic index over ranked players, keyed by
+	(-rating_mu, rating_phi, id) so that iteration order is leaderboard order.
+	"""
+	def __init__(self):
+		self.keys = {}
+		self.order = SortedList()
+		self.version = 0
+		# The version of the last change of every player changed since
+		# known_version, so that views derived from the index can update only
+		# those players. Older changes are forgotten by load and forget_changes.
+		self.known_version = 0
+		self.changes = {}
+
+	async def load(self):
+		"""
+		Rebuilds the index from the database.
+		"""
+		rows = await database.fetchall(queries.ranked_ratings)
+		self.keys = {
+			row["id"]: (-row["rating_mu"], row["rating_phi"], row["id"])
+			for row in rows
+		}
+		self.order = SortedList(self.keys.values())
+		self.version += 1
+		self.known_version = self.version
+		self.changes = {}
+
+	def change(self, player_id):
+		self.version += 1
+		self.changes[player_id] = self.version
+
+	def get_changes(self, version):
+		"""
+		:return: The IDs of the players changed after the version, or None if the
+		changes since then are no longer known, in which case anyone may have
+		changed.
+		"""
+		if version < self.known_version:
+			return None
+		return [player_id for player_id, change in self.changes.items() if change > version]
+
+	def forget_changes(self, version):
+		"""
+		Drops the changes up to the version, once the views that needed them are
+		updated, so that the changes don't pile up until the next load.
+		"""
+		if version > self.known_version:
+			self.known_version = version
+			self.changes = {
+				player_id: change for player_id, change in self.changes.items()
+				if change > version
+			}
+
+	def update(self, player_id, mu, phi):
+		"""
+		Records the new rating of a registered player. Players without a rank are
+		kept out of the index.
+		"""
+		old_key = self.keys.pop(player_id, None)
+		if old_key is not None:
+			self.order.remove(old_key)
+		if utils.get_rank_value(mu, phi) != -1:
+			key = (-mu, phi, player_id)
+			self.keys[player_id] = key
+			self.order.add(key)
+		self.change(player_id)
+
+	def remove(self, player_id):
+		"""
+		Takes a player out of the index, used when they unregister.
+		"""
+		old_key = self.keys.pop(player_id, None)
+		if old_key is not None:
+			self.order.remove(old_key)
+			self.change(player_id)
+
+	def touch(self, player_id):
+		"""
+		Marks the player as changed without changing the order, used when their
+		name or platforms change.
+		"""
+		self.change(player_id)
+
+	def position(self, mu, phi):
+		"""
+		:return: The 1-based leaderboard position of a rating. Players with equal
+		ratings share the same position.
+		"""
+		return self.order.bisect_left((-mu, phi)) + 1
+
+	def page(self, start, stop):
+		"""
+		:return: The IDs of the players at the 0-based positions [start, stop).
+		"""
+		return [key[2] for key in self.order.islice(start, stop)]
+
+	def __len__(self):
+		return len(self.order)
+
+rank_index = RankIndex()
@@ -0,0 +1,208 @@
+# This module applies every rank role change, from single matches to the many
+# ones caused by a rating period rollover. Changes are first stored in the
+# role_sync_queue table, in the same transaction as the rating changes, so
+# that they survive a restart. A few concurrent workers then apply them, and
+# the ones that failed are retried with a backoff.
+
+import asyncio
+import discord
+from logger import logger
+from config import get_int, get_bool
+from core import database
+from core import queries
+from core import utils
+
+def get_rank_by_value(value):
+	if value is None:
+		return None
+	return utils.rank_null if value == -1 else utils.ranks[value]
+
+def compute_transitions(changes):
+	"""
+	:param changes: An iterable of (member_id, old_mu, old_phi, new_mu, new_phi),
+	where a mu of None means no rank role at all.
+	:return: A list of (member_id, old_rank, new_rank) for the members whose
+	rank changes, with ranks as rank values.
+	"""
+	transitions = []
+	for member_id, old_mu, old_phi, new_mu, new_phi in changes:
+		old_rank = None if old_mu is None else utils.get_rank_value(old_mu, old_phi)
+		new_rank = None if new_mu is None else utils.get_rank_value(new_mu, new_phi)
+		if old_rank != new_rank:
+			transitions.append((member_id, old_rank, new_rank))
+	return transitions
+
+def queue_transitions(connection, transitions):
+	"""
+	Stores transitions in the queue. Meant to be called inside the transaction
+	that changes the ratings, see database.write. If a member already has a
+	queued transition, its old rank is kept since that is the role the member
+	actually has.
+	"""
+	connection.executemany(
+		"INSERT INTO role_sync_queue (member_id, old_rank, new_rank) VALUES (?, ?, ?) "
+		"ON CONFLICT (member_id) DO UPDATE SET new_rank = excluded.new_rank",
+		transitions
+	)
+
+def finish_transitions(connection, transitions):
+	# A transition queued while an older one was being applied now starts from
+	# the rank that was applied, and becomes a no-op if it goes back to it.
+	connection.executemany(
+		"UPDATE role_sync_queue SET old_rank = ? WHERE member_id = ? AND old_rank IS ?",
+		[(new_rank, member_id, old_rank) for member_id, old_rank, new_rank in transitions]
+	)
+	connection.execute("DELETE FROM role_sync_queue WHERE old_rank IS new_rank")
+
+class RoleSync:
+	"""
+	Drains the role_sync_queue table with a bounded number of concurrent
+	workers. The rate limits of the Discord API are followed by discord.py
+	itself, the concurrency bound keeps a rollover from hogging the bucket.
+	"""
+	progress_interval = 100
+	flush_interval = 50
+	max_attempts = 3
+
+	def __init__(self):
+		self.running = False
+		self.done = []
+		self.processed = 0
+		self.total = 0
+		# The number of transitions of the current drain left in the queue, and
+		# the number of drains in a row that left some.
+		self.failed = 0
+		self.failures = 0
+		self.retry_handle = None
+
+	def setup(self):
+		if self.running: return
+		self.running = True
+		self.wakeup = asyncio.Event()
+		# Resume whatever was left in the queue before the last shutdown.
+		self.wakeup.set()
+		asyncio.create_task(self.run())
+
+	def notify(self):
+		"""
+		Wakes up the workers after new transitions have been queued.
+		"""
+		if self.running:
+			self.wakeup.set()
+
+	async def run(self):
+		while True:
+			await self.wakeup.wait()
+			self.wakeup.clear()
+			try:
+				await self.drain()
+			except Exception as e:
+				utils.log_error(e)
+				self.schedule_retry()
+
+	async def drain(self):
+		rows = await database.fetchall(queries.role_sync_queue)
+		if len(rows) == 0:
+			return
+		dry_run = get_bool("role_sync_dry_run", False)
+		concurrency = get_int("role_sync_concurrency", 4)
+		logger.info(
+			f"Synchronizing the rank roles of {len(rows)} members"
+			f"{' (dry run)' if dry_run else ''}."
+		)
+		jobs = asyncio.Queue()
+		for row in rows:
+			jobs.put_nowait(row.tuple)
+		self.processed = 0
+		self.total = len(rows)
+		workers = [
+			asyncio.create_task(self.work(jobs, dry_run))
+			for _ in range(concurrency)
+		]
+		self.failed = 0
+		await jobs.join()
+		for worker in workers:
+			worker.cancel()
+		await self.flush()
+		logger.info(f"Rank role synchronization finished, {self.processed} members processed.")
+		if self.failed != 0 and not dry_run:
+			self.schedule_retry()
+		else:
+			self.failures = 0
+
+	def schedule_retry(self):
+		"""
+		Drains the queue again after an exponential backoff, for the transitions
+		that failed.
+		"""
+		self.failures += 1
+		delay = min(300, 5 * 2**self.failures)
+		logger.info(f"Rank role synchronization incomplete, retrying in {delay} seconds.")
+		if self.retry_handle is not None:
+			self.retry_handle.cancel()
+		self.retry_handle = asyncio.get_running_loop().call_later(delay, self.wakeup.set)
+
+	async def work(self, jobs, dry_run):
+		while True:
+			transition = await jobs.get()
+			try:
+				if dry_run:
+					# Nothing is applied, so the queue is left as it is.
+					self.log_transition(*transition)
+				elif await self.apply(*transition):
+					self.done.append(transition)
+				else:
+					self.failed += 1
+				if len(self.done) >= self.flush_interval:
+					await self.flush()
+			except (discord.Forbidden, discord.NotFound) as e:
+				# Retrying won't help, so the transition is dropped.
+				logger.warning(f"Rank role synchronization of {transition[0]} dropped: {e}")
+				self.done.append(transition)
+			except Exception as e:
+				# Left in the queue, retried on the next drain.
+				utils.log_error(e)
+				self.failed += 1
+			finally:
+				self.processed += 1
+				if self.processed % self.progress_interval == 0:
+					logger.info(f"Rank role synchronization: {self.processed}/{self.total}.")
+				jobs.task_done()
+
+	async def flush(self):
+		done, self.done = self.done, []
+		if len(done) != 0:
+			await database.write(finish_transitions, done)
+
+	def log_transition(self, member_id, old_rank, new_rank):
+		old_rank = get_rank_by_value(old_rank)
+		new_rank = get_rank_by_value(new_rank)
+		logger.info(
+			f"Role sync dry run: {member_id} "
+			f"{'none' if old_rank is None else old_rank.name} -> "
+			f"{'none' if new_rank is None else new_rank.name}"
+		)
+
+	async def apply(self, member_id, old_rank, new_rank):
+		"""
+		:return: True if the transition is done, False if it should be retried.
+		"""
+		old_rank = get_rank_by_value(old_rank)
+		new_rank = get_rank_by_value(new_rank)
+		for attempt in range(self.max_attempts):
+			try:
+				member = await utils.get_member(member_id)
+				if member is None:
+					return True
+				if old_rank is not None:
+					await member.remove_roles(discord.Object(old_rank.role_id))
+				if new_rank is not None:
+					await member.add_roles(discord.Object(new_rank.role_id))
+				return True
+			except discord.HTTPException as e:
+				if e.status != 429 and e.status < 500:
+					raise
+				await asyncio.sleep(2 ** attempt)
+		return False
+
+role_sync = RoleSync()
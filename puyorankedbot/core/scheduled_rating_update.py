@@ -4,11 +4,14 @@
 import asyncio
 import json
 import os
-from datetime import datetime
+import time
 from logger import logger
 from config import get_config
-from core.database import database
+from core import database
 from core import utils
+from core.rank_index import rank_index
+from core.event_log import event_log
+from core.role_sync import role_sync, compute_transitions, queue_transitions
 
 running = False
 
@@ -18,25 +21,71 @@ def setup():
 	asyncio.create_task(update_loop())
 	running = True
 
-async def update_ratings(c):
-	feed_in = database.execute("SELECT rowid, id, platforms, rating_mu, rating_phi FROM players")
-	feed_out = database.cursor()
-	while True:
-		batch = feed_in.fetchmany(1024)
-		if len(batch) == 0: break
-		data_load = []
-		for player in batch:
-			mu = player[3]
-			old_phi = player[4]
-			new_phi = min(350, (old_phi**2 + c)**0.5)
-			if player[2] != "":
-				await utils.update_role(player[1], mu, old_phi, mu, new_phi)
-			data_load.append((new_phi, player[0]))
-		feed_out.executemany(
-			"UPDATE players SET rating_phi = ? WHERE rowid = ?",
-			data_load
-		)
-	database.commit()
+def decay_phi(phi, c):
+	return min(350, (phi**2 + c)**0.5)
+
+def decay_ratings(connection, c):
+	"""
+	Increases the rating deviation of every player for the passing of rating
+	periods, with a single UPDATE statement.
+	:param connection: A connection inside a transaction, see database.write.
+	:param c: The increase of the variance.
+	:return: A list of (id, rating_mu, old_phi, new_phi) of the registered
+	players whose phi crossed utils.placement_phi. Since mu doesn't change,
+	these are exactly the players whose rank changes.
+	"""
+	connection.create_function("decay_phi", 2, decay_phi, deterministic=True)
+	# decay_phi(phi) >= placement_phi is equivalent to phi >= lowest_phi, which
+	# turns the search into a range scan of players_phi. The function is still
+	# applied to that range so that rounding can't make them disagree.
+	threshold = utils.placement_phi
+	lowest_phi = max(0, threshold**2 - c)**0.5
+	crossings = connection.execute(
+		"SELECT id, rating_mu, rating_phi, decay_phi(rating_phi, :c) FROM players "
+		"WHERE platforms <> '' AND rating_phi >= :lowest AND rating_phi < :threshold "
+		"AND decay_phi(rating_phi, :c) >= :threshold",
+		{"c": c, "lowest": lowest_phi * (1 - 1e-9), "threshold": threshold}
+	).fetchall()
+	# Players already at the maximum deviation don't need to be rewritten.
+	connection.execute(
+		"UPDATE players SET rating_phi = decay_phi(rating_phi, ?) WHERE rating_phi < 350",
+		(c,)
+	)
+	return [row.tuple for row in crossings]
+
+def claim_period(connection, period_start):
+	"""
+	Records that the decay up to the rating period starting at period_start is
+	applied.
+	:return: False if it already was, in which case it must not be applied again.
+	"""
+	return connection.execute(
+		"UPDATE rating_decay SET period_start = ? WHERE period_start < ?",
+		(period_start, period_start)
+	).rowcount != 0
+
+async def update_ratings(c, period_start):
+	"""
+	:param period_start: The POSIX time at which the rating period the decay
+	leads up to starts.
+	"""
+	def apply(connection):
+		if not claim_period(connection, period_start):
+			return None
+		crossings = decay_ratings(connection, c)
+		queue_transitions(connection, compute_transitions(
+			(player_id, mu, old_phi, mu, new_phi)
+			for player_id, mu, old_phi, new_phi in crossings
+		))
+		return crossings
+	crossings = await database.write(apply)
+	if crossings is None:
+		logger.warning("The rating period update was already applied, skipped.")
+		return
+	event_log.append("decay", c=c, period_start=period_start)
+	logger.info(f"Rating period update done, {len(crossings)} players lost their rank.")
+	await rank_index.load()
+	role_sync.notify()
 
 file_name = "../rating_period_info.json"
 
@@ -47,7 +96,7 @@ async def update_loop():
 	start = get_config("rating_period_start")
 	length = get_config("rating_period_length")
 	c = get_config("rating_phi_increase_rate")
-	period = (int(datetime.utcnow().timestamp()) - start) // length
+	period = (int(time.time()) - start) // length
 
 	if os.path.exists(file_name):
 		with open(file_name) as f: period_info = json.load(f)
@@ -58,7 +107,7 @@ async def update_loop():
 			period_info["period"] = period
 			save_period_info(period_info)
 		elif period_info["period"] != period:
-			await update_ratings((period - period_info["period"]) * c)
+			await update_ratings((period - period_info["period"]) * c, start + period*length)
 			period_info["period"] = period
 			save_period_info(period_info)
 	else:
@@ -73,8 +122,8 @@ async def update_loop():
 	next_update = start + (period+1)*length
 	while True:
 		try:
-			await asyncio.sleep(next_update - int(datetime.utcnow().timestamp()))
-			await update_ratings(c)
+			await asyncio.sleep(next_update - int(time.time()))
+			await update_ratings(c, next_update)
 			period += 1
 			period_info["period"] = period
 			save_period_info(period_info)
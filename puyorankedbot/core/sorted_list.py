@@ -0,0 +1,170 @@
+# This module contains a sorted sequence that supports insertion, removal and
+# access by position in logarithmic time.
+
+from bisect import bisect_left, bisect_right, insort
+
+class SortedList:
+	"""
+	A list that keeps its items sorted. Items are stored in buckets of bounded
+	size, and a Fenwick tree over the bucket sizes maps positions to buckets.
+	"""
+	load = 256
+
+	def __init__(self, items=()):
+		"""
+		:param items: Initial items, in any order.
+		"""
+		items = sorted(items)
+		self.size = len(items)
+		self.buckets = [
+			items[i:i + self.load]
+			for i in range(0, len(items), self.load)
+		]
+		self.maxes = [bucket[-1] for bucket in self.buckets]
+		self.build_tree()
+
+	def build_tree(self):
+		tree = [0] + [len(bucket) for bucket in self.buckets]
+		for i in range(1, len(tree)):
+			j = i + (i & -i)
+			if j < len(tree):
+				tree[j] += tree[i]
+		self.tree = tree
+
+	def tree_add(self, bucket_index, delta):
+		i = bucket_index + 1
+		while i < len(self.tree):
+			self.tree[i] += delta
+			i += i & -i
+
+	def tree_prefix(self, bucket_count):
+		"""
+		:return: The number of items in the first bucket_count buckets.
+		"""
+		total = 0
+		i = bucket_count
+		while i > 0:
+			total += self.tree[i]
+			i -= i & -i
+		return total
+
+	def locate(self, index):
+		"""
+		:return: (bucket index, index inside the bucket) of the item at a position.
+		"""
+		position = 0
+		step = 1 << (len(self.tree) - 1).bit_length()
+		while step:
+			next_position = position + step
+			if next_position < len(self.tree) and self.tree[next_position] <= index:
+				position = next_position
+				index -= self.tree[position]
+			step >>= 1
+		return position, index
+
+	def add(self, item):
+		if self.size == 0:
+			self.buckets = [[item]]
+			self.maxes = [item]
+			self.size = 1
+			self.build_tree()
+			return
+		b = bisect_left(self.maxes, item)
+		if b == len(self.maxes):
+			b -= 1
+		bucket = self.buckets[b]
+		insort(bucket, item)
+		self.maxes[b] = bucket[-1]
+		self.size += 1
+		if len(bucket) > 2 * self.load:
+			self.buckets[b:b + 1] = [bucket[:self.load], bucket[self.load:]]
+			self.maxes[b:b + 1] = [bucket[self.load - 1], bucket[-1]]
+			self.build_tree()
+		else:
+			self.tree_add(b, 1)
+
+	def remove(self, item):
+		"""
+		:raise ValueError: If the item is not in the list.
+		"""
+		b = bisect_left(self.maxes, item)
+		if b == len(self.maxes):
+			raise ValueError(f"{item!r} is not in the list")
+		bucket = self.buckets[b]
+		i = bisect_left(bucket, item)
+		if bucket[i] != item:
+			raise ValueError(f"{item!r} is not in the list")
+		del bucket[i]
+		self.size -= 1
+		if len(bucket) == 0:
+			del self.buckets[b]
+			del self.maxes[b]
+			self.build_tree()
+		else:
+			self.maxes[b] = bucket[-1]
+			self.tree_add(b, -1)
+
+	def discard(self, item):
+		try:
+			self.remove(item)
+		except ValueError:
+			pass
+
+	def bisect_left(self, item):
+		"""
+		:return: The number of items less than the given one.
+		"""
+		b = bisect_left(self.maxes, item)
+		if b == len(self.maxes):
+			return self.size
+		return self.tree_prefix(b) + bisect_left(self.buckets[b], item)
+
+	def bisect_right(self, item):
+		"""
+		:return: The number of items less than or equal to the given one.
+		"""
+		b = bisect_right(self.maxes, item)
+		if b == len(self.maxes):
+			return self.size
+		return self.tree_prefix(b) + bisect_right(self.buckets[b], item)
+
+	def islice(self, start, stop):
+		"""
+		Iterates over the items at positions [start, stop).
+		"""
+		start = max(start, 0)
+		stop = min(stop, self.size)
+		if start >= stop:
+			return
+		b, i = self.locate(start)
+		remaining = stop - start
+		while remaining > 0:
+			bucket = self.buckets[b]
+			chunk = bucket[i:i + remaining]
+			yield from chunk
+			remaining -= len(chunk)
+			b += 1
+			i = 0
+
+	def __getitem__(self, index):
+		if index < 0:
+			index += self.size
+		if not 0 <= index < self.size:
+			raise IndexError("SortedList index out of range")
+		b, i = self.locate(index)
+		return self.buckets[b][i]
+
+	def __contains__(self, item):
+		b = bisect_left(self.maxes, item)
+		if b == len(self.maxes):
+			return False
+		bucket = self.buckets[b]
+		i = bisect_left(bucket, item)
+		return i < len(bucket) and bucket[i] == item
+
+	def __iter__(self):
+		for bucket in self.buckets:
+			yield from bucket
+
+	def __len__(self):
+		return self.size
@@ -1,18 +1,15 @@
-import discord
 from logger import logger
 import traceback
 import re
 from bisect import bisect
 import config
+from core.member_cache import member_cache
 
 bot = None
 guild = None
 
 async def get_member(member_id):
-	try:
-		return await guild.fetch_member(member_id)
-	except discord.NotFound:
-		return None
+	return await member_cache.get(member_id)
 
 def parse_integer(s, mustNotBeNegative=False):
 	try:
@@ -51,7 +48,11 @@ class Rank:
 		self.name = name
 		self.color = color
 		self.value = value
-		self.role_id = config.get_config("rank_roles")[name.lower()]
+
+	@property
+	def role_id(self):
+		# Looked up every time so that changes of rank_roles apply without a restart.
+		return config.get_config("rank_roles")[self.name.lower()]
 
 ranks = [
 	Rank("Bronze", 0xE7A264, 0),
@@ -63,17 +64,21 @@ ranks = [
 ]
 rank_null = Rank("Placements", 0x9D9D9D, -1)
 rank_threshold_mapping = [1000, 1200, 1600, 2000, 2200]
+# Players are placed into a rank once their rating deviation is below this.
+# The ranked queries of core.queries are built from it, and read the players
+# through the players_phi index, which doesn't depend on the value.
+placement_phi = 150
 match_goals = [10, 10, 10, 10, 10, 10]
 
 def get_rank(mu, phi=0):
 	return (
 		None if mu is None else
-		ranks[bisect(rank_threshold_mapping, mu)] if phi < 150 else rank_null
+		ranks[bisect(rank_threshold_mapping, mu)] if phi < placement_phi else rank_null
 	)
 
 # Convenience function to directly get the rank value without going through the rank object.
 def get_rank_value(mu, phi=0):
-	return bisect(rank_threshold_mapping, mu) if phi < 150 else -1
+	return bisect(rank_threshold_mapping, mu) if phi < placement_phi else -1
 
 def get_match_goal(mu1, mu2):
 	return match_goals[get_rank_value(mu1)+get_rank_value(mu2)+1 >> 1]
@@ -91,17 +96,6 @@ def get_rank_with_comparison(old_mu, old_phi, new_mu, new_phi):
 		else:
 			return f"**{'Promoted' if new_mu > old_mu else 'Demoted'} to {new_rank.name}**"
 
-async def update_role(member_id, old_mu, old_phi, new_mu, new_phi):
-	old_rank = get_rank(old_mu, old_phi)
-	new_rank = get_rank(new_mu, new_phi)
-	if old_rank == new_rank: return
-	member = await get_member(member_id)
-	if member is None: return
-	if old_mu is not None:
-		await member.remove_roles(discord.Object(old_rank.role_id))
-	if new_mu is not None:
-		await member.add_roles(discord.Object(new_rank.role_id))
-
 
 def escape_markdown(s):
 	return re.sub(
@@ -0,0 +1,25 @@
+# Recomputes the player_stats table from the whole match history.
+# The PlayerStats trigger keeps the table up to date on its own; this is only
+# needed if the table was modified by hand or matches were edited or deleted.
+# Run from the puyorankedbot directory: python -m tools.rebuild_player_stats
+
+import argparse
+import sqlite3
+import time
+
+def main():
+	parser = argparse.ArgumentParser(description="Rebuild the player_stats table.")
+	parser.add_argument("--database", default="../data.db3")
+	args = parser.parse_args()
+
+	connection = sqlite3.connect(args.database)
+	start = time.perf_counter()
+	with connection:
+		connection.execute("DELETE FROM player_stats")
+		connection.execute("INSERT INTO player_stats SELECT * FROM player_stats_rebuild")
+	count = connection.execute("SELECT COUNT(*) FROM player_stats").fetchone()[0]
+	connection.close()
+	print(f"Rebuilt statistics of {count} players in {time.perf_counter() - start:.1f} s.")
+
+if __name__ == "__main__":
+	main()
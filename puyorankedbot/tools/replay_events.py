@@ -0,0 +1,215 @@
+# Rebuilds the database from the event journal of core.event_log, up to a
+# point in time. The replay starts from an empty database, or from a backup
+# with --base, in which case the events whose journal sequence is already in
+# the backup are skipped. Events hold the values that were written, so they
+# are applied as they are without any rating computation.
+# The role_sync_queue table is not rebuilt, the bot fills it again as ratings
+# change.
+# Run from the puyorankedbot directory: python -m tools.replay_events --until "2021-05-01 12:00"
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime, timezone
+from core import database
+
+def parse_time(text):
+	"""
+	:param text: A POSIX timestamp, or an ISO 8601 date in UTC.
+	"""
+	try:
+		return float(text)
+	except ValueError:
+		return datetime.fromisoformat(text).replace(tzinfo=timezone.utc).timestamp()
+
+def format_time(timestamp):
+	# The format of datetime('now'), which fills the date columns.
+	return datetime.utcfromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+def decay_phi(phi, c):
+	return min(350, (phi**2 + c)**0.5)
+
+class Replay:
+	def __init__(self, connection):
+		self.connection = connection
+		self.connection.create_function("decay_phi", 2, decay_phi, deterministic=True)
+		# Column names come from the journal, they are checked against these
+		# before being put in statements.
+		self.columns = {
+			table: {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+			for table in ("players", "matches")
+		}
+		self.handlers = {
+			"register": self.register,
+			"unregister": self.update_player,
+			"update_player": self.update_player,
+			"match_created": self.match_created,
+			"report": self.match_state,
+			"confirm": self.match_state,
+			"cancel": self.match_state,
+			"match_cancelled": self.delete_pending_match,
+			"match_recorded": self.match_recorded,
+			"timeout": self.timeout,
+			"decay": self.decay
+		}
+
+	def check_columns(self, table, columns):
+		unknown = set(columns) - self.columns[table]
+		if len(unknown) != 0:
+			raise ValueError(f"Unknown columns of {table}: {', '.join(sorted(unknown))}")
+
+	def apply(self, event):
+		handler = self.handlers.get(event["type"])
+		if handler is None:
+			raise ValueError(f"Unknown event type {event['type']}.")
+		handler(event)
+
+	def register(self, event):
+		self.connection.execute(
+			"INSERT OR IGNORE INTO players (id, registration_date, platforms) VALUES (?, ?, ?)",
+			(event["id"], format_time(event["time"]), event["platforms"])
+		)
+		self.connection.execute(
+			"UPDATE players SET platforms = ? WHERE id = ?",
+			(event["platforms"], event["id"])
+		)
+
+	def update_player(self, event):
+		fields = event["fields"]
+		self.check_columns("players", fields)
+		self.connection.execute(
+			f"UPDATE players SET {', '.join(f'{column} = :{column}' for column in fields)} "
+			"WHERE id = :id",
+			{**fields, "id": event["id"]}
+		)
+
+	def match_created(self, event):
+		self.connection.execute(
+			"INSERT OR REPLACE INTO pending_matches (message_id, player1, player2, time) "
+			"VALUES (?, ?, ?, ?)",
+			(event["message_id"], event["player1"], event["player2"], event["created"])
+		)
+
+	def match_state(self, event):
+		self.connection.execute(
+			"UPDATE pending_matches SET "
+			"player1_score = :player1_score, player2_score = :player2_score, "
+			"confirm_status = :confirm_status, cancel_status = :cancel_status, "
+			"confirming_timestamp = :confirming_timestamp "
+			"WHERE message_id = :message_id",
+			event
+		)
+
+	def delete_pending_match(self, event):
+		self.connection.execute(
+			"DELETE FROM pending_matches WHERE message_id = ?",
+			(event["message_id"],)
+		)
+
+	def match_recorded(self, event):
+		match = event["match"]
+		self.check_columns("matches", match)
+		# Ignored if the match is already there, the triggers that update the
+		# players and player_stats only run for new matches.
+		self.connection.execute(
+			f"INSERT OR IGNORE INTO matches ({', '.join(match)}) "
+			f"VALUES ({', '.join(':' + column for column in match)})",
+			match
+		)
+		self.delete_pending_match(event)
+
+	def timeout(self, event):
+		self.connection.executemany(
+			"UPDATE players SET rating_mu = ?, rating_phi = ?, rating_sigma = ? WHERE id = ?",
+			[(mu, phi, sigma, player_id) for player_id, mu, phi, sigma in event["ratings"]]
+		)
+		self.delete_pending_match(event)
+
+	def decay(self, event):
+		# The same check as claim_period of core.scheduled_rating_update.
+		if self.connection.execute(
+			"UPDATE rating_decay SET period_start = ? WHERE period_start < ?",
+			(event["period_start"], event["period_start"])
+		).rowcount == 0:
+			return
+		self.connection.execute(
+			"UPDATE players SET rating_phi = decay_phi(rating_phi, ?) WHERE rating_phi < 350",
+			(event["c"],)
+		)
+
+def copy_base(base, output):
+	if base.endswith(".gz"):
+		with gzip.open(base, "rb") as source, open(output, "wb") as target:
+			shutil.copyfileobj(source, target)
+	else:
+		source = sqlite3.connect(base)
+		target = sqlite3.connect(output)
+		source.backup(target)
+		target.close()
+		source.close()
+
+def main():
+	parser = argparse.ArgumentParser(description="Rebuild the database from the event journal.")
+	parser.add_argument("--journal", default="../events.jsonl")
+	parser.add_argument("--output", default="../data_replayed.db3")
+	parser.add_argument("--base", help="A backup to start from instead of an empty database.")
+	parser.add_argument(
+		"--since", type=parse_time, default=float("-inf"),
+		help="Also skip the events before this time."
+	)
+	parser.add_argument(
+		"--until", type=parse_time, default=float("inf"),
+		help="Stop at this time, a POSIX timestamp or an ISO 8601 date in UTC."
+	)
+	parser.add_argument("--batch-size", type=int, default=10000, help="The number of events per transaction.")
+	args = parser.parse_args()
+	if os.path.exists(args.output):
+		parser.error(f"{args.output} already exists.")
+
+	start = time.perf_counter()
+	if args.base is not None:
+		copy_base(args.base, args.output)
+	database.path = args.output
+	database.migrate()
+	connection = sqlite3.connect(args.output)
+	base_sequence = connection.execute("SELECT sequence FROM journal_state").fetchone()[0]
+	sequence = base_sequence
+	replay = Replay(connection)
+	count = 0
+	skipped = 0
+	last_time = None
+	with open(args.journal, encoding="utf-8") as journal:
+		for line_number, line in enumerate(journal, 1):
+			try:
+				event = json.loads(line)
+			except json.JSONDecodeError:
+				# The last line is cut short if the bot stopped while writing it.
+				print(f"Line {line_number} is unreadable, skipped.")
+				continue
+			if event["sequence"] <= base_sequence or event["time"] < args.since:
+				skipped += 1
+				continue
+			if event["time"] > args.until:
+				break
+			replay.apply(event)
+			sequence = max(sequence, event["sequence"])
+			last_time = event["time"]
+			count += 1
+			if count % args.batch_size == 0:
+				connection.commit()
+	# So that the output can be the base of another replay.
+	connection.execute("UPDATE journal_state SET sequence = ?", (sequence,))
+	connection.commit()
+	connection.close()
+	print(
+		f"Replayed {count} events, skipped {skipped}, "
+		f"up to {format_time(last_time) if last_time is not None else 'the start'} "
+		f"in {time.perf_counter() - start:.1f} s."
+	)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,188 @@
+# Recomputes every rating from the match history, to try out changes of the
+# rating parameters before applying them. Matches are streamed in ID order
+# and rated one by one like the bot does, or by rating period. The rating
+# period decay is applied lazily to each player when they play again. The
+# results are written to the replay_ratings table and compared with the
+# players table.
+# Match timeouts change ratings without inserting a match, so players who
+# had some will differ slightly even with unchanged parameters.
+# Run from the puyorankedbot directory: python -m tools.replay_ratings
+
+import argparse
+import sqlite3
+import time
+from bisect import bisect
+from config import get_config
+from core import utils
+from core.batch_rating import BatchRating
+
+class Replay:
+	"""
+	The ratings of the players seen so far, as (mu, phi, sigma, period of the
+	last update).
+	"""
+	def __init__(self, args):
+		self.args = args
+		self.ratings = {}
+		self.engine = BatchRating(tau=args.tau)
+
+	def get_period(self, timestamp):
+		return (timestamp - self.args.start) // self.args.length
+
+	def decay(self, rating, period):
+		mu, phi, sigma, last_period = rating
+		if period > last_period:
+			phi = min(350, (phi**2 + self.args.c * (period - last_period))**0.5)
+		return (mu, phi, sigma, period)
+
+	def get_rating(self, player_id, period):
+		rating = self.ratings.get(player_id)
+		if rating is None:
+			return (1500, 350, 0.06, period)
+		return self.decay(rating, period)
+
+	def rate_match(self, player1, player2, score1, score2, period):
+		rating1 = self.get_rating(player1, period)
+		rating2 = self.get_rating(player2, period)
+		if score1 > score2:
+			new_rating1, new_rating2 = self.engine.rate_1vs1(rating1, rating2)
+		else:
+			new_rating2, new_rating1 = self.engine.rate_1vs1(rating2, rating1)
+		self.ratings[player1] = (*new_rating1, period)
+		self.ratings[player2] = (*new_rating2, period)
+
+	def rate_period(self, games, period):
+		"""
+		Rates all the games of a period together with the batch engine.
+		:param games: A list of (player1, player2, score1).
+		"""
+		ratings = {}
+		for player1, player2, _ in games:
+			for player_id in (player1, player2):
+				if player_id not in ratings:
+					ratings[player_id] = self.get_rating(player_id, period)[:3]
+		for player_id, rating in self.engine.rate_period(ratings, games).items():
+			self.ratings[player_id] = (*rating, period)
+
+	def run(self, connection):
+		"""
+		:return: The number of replayed matches.
+		"""
+		cursor = connection.execute(
+			"SELECT player1, player2, player1_score, player2_score, "
+			"CAST(strftime('%s', date) AS INTEGER) FROM matches ORDER BY id"
+		)
+		count = 0
+		games = []
+		games_period = None
+		while True:
+			batch = cursor.fetchmany(self.args.batch_size)
+			if len(batch) == 0: break
+			for player1, player2, score1, score2, timestamp in batch:
+				period = self.get_period(timestamp)
+				if self.args.by_period:
+					if period != games_period and len(games) != 0:
+						self.rate_period(games, games_period)
+						games = []
+					games_period = period
+					games.append((player1, player2, 1 if score1 > score2 else 0))
+				else:
+					self.rate_match(player1, player2, score1, score2, period)
+			count += len(batch)
+		if len(games) != 0:
+			self.rate_period(games, games_period)
+		return count
+
+	def get_rank(self, mu, phi):
+		thresholds = self.args.thresholds
+		return bisect(thresholds, mu) if phi < utils.placement_phi else -1
+
+	def save(self, connection):
+		period = self.get_period(int(time.time()))
+		with connection:
+			connection.execute("DROP TABLE IF EXISTS replay_ratings")
+			connection.execute(
+				"CREATE TABLE replay_ratings (id BIGINT PRIMARY KEY NOT NULL, "
+				"rating_mu DOUBLE NOT NULL, rating_phi DOUBLE NOT NULL, "
+				"rating_sigma DOUBLE NOT NULL, rank INTEGER NOT NULL)"
+			)
+			connection.executemany(
+				"INSERT INTO replay_ratings VALUES (?, ?, ?, ?, ?)",
+				(
+					(player_id, mu, phi, sigma, self.get_rank(mu, phi))
+					for player_id, (mu, phi, sigma, _) in (
+						(player_id, self.decay(rating, period))
+						for player_id, rating in self.ratings.items()
+					)
+				)
+			)
+
+def report(connection, show):
+	summary = connection.execute("""
+		SELECT
+			COUNT(*),
+			AVG(ABS(replay.rating_mu - players.rating_mu)),
+			MAX(ABS(replay.rating_mu - players.rating_mu)),
+			AVG(ABS(replay.rating_phi - players.rating_phi))
+		FROM replay_ratings AS replay JOIN players ON players.id = replay.id
+	""").fetchone()
+	print(
+		f"{summary[0]} players compared | mu difference mean {summary[1] or 0:.2f}, "
+		f"max {summary[2] or 0:.2f} | phi difference mean {summary[3] or 0:.2f}"
+	)
+	changes = []
+	for player_id, display_name, mu, phi, new_mu, new_phi, new_rank in connection.execute("""
+		SELECT players.id, players.display_name,
+			players.rating_mu, players.rating_phi,
+			replay.rating_mu, replay.rating_phi, replay.rank
+		FROM replay_ratings AS replay JOIN players ON players.id = replay.id
+		ORDER BY ABS(replay.rating_mu - players.rating_mu) DESC
+	"""):
+		old_rank = utils.get_rank_value(mu, phi)
+		if old_rank != new_rank or len(changes) < show:
+			changes.append((player_id, display_name, mu, phi, new_mu, new_phi, old_rank, new_rank))
+	rank_changes = sum(change[6] != change[7] for change in changes)
+	print(f"{rank_changes} players change rank.")
+	for player_id, display_name, mu, phi, new_mu, new_phi, old_rank, new_rank in changes[:show]:
+		print(
+			f"{display_name or player_id}: {mu:.0f} ± {2 * phi:.0f} -> "
+			f"{new_mu:.0f} ± {2 * new_phi:.0f}"
+			f"{'' if old_rank == new_rank else f' (rank {old_rank} -> {new_rank})'}"
+		)
+
+def main():
+	parser = argparse.ArgumentParser(description="Replay the match history with other rating parameters.")
+	parser.add_argument("--database", default="../data.db3")
+	parser.add_argument("--tau", type=float, default=1.0, help="The Glicko-2 system constant.")
+	parser.add_argument("--c", type=float, help="The phi increase rate, rating_phi_increase_rate by default.")
+	parser.add_argument("--start", type=int, help="rating_period_start by default.")
+	parser.add_argument("--length", type=int, help="rating_period_length by default.")
+	parser.add_argument(
+		"--thresholds", type=float, nargs=len(utils.rank_threshold_mapping),
+		default=utils.rank_threshold_mapping, help="The lowest ratings of the ranks above Bronze."
+	)
+	parser.add_argument(
+		"--by-period", action="store_true",
+		help="Rate all the games of a rating period together instead of one by one."
+	)
+	parser.add_argument("--batch-size", type=int, default=10000)
+	parser.add_argument("--show", type=int, default=10, help="The number of largest differences shown.")
+	args = parser.parse_args()
+	if args.c is None: args.c = get_config("rating_phi_increase_rate")
+	if args.start is None: args.start = get_config("rating_period_start")
+	if args.length is None: args.length = get_config("rating_period_length")
+
+	connection = sqlite3.connect(args.database)
+	start = time.perf_counter()
+	replay = Replay(args)
+	count = replay.run(connection)
+	replay.save(connection)
+	print(
+		f"Replayed {count} matches of {len(replay.ratings)} players "
+		f"in {time.perf_counter() - start:.1f} s."
+	)
+	report(connection, args.show)
+	connection.close()
+
+if __name__ == "__main__":
+	main()